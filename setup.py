@@ -48,6 +48,7 @@ setup(
     ftp=shove.stores.ftp:FTPStore
     hdf5=shove.stores.hdf5:HDF5Store
     leveldb=shove.stores.leveldbstore:LevelDBStore
+    log=shove.stores.logstore:LogStore
     memory=shove.store:MemoryStore
     mongodb=shove.stores.mongodb:MongoDBStore
     mssql=shove.store.db:DBStore
@@ -57,6 +58,7 @@ setup(
     redis=shove.stores.redisdb:RedisStore
     s3=shove.stores.s3:S3Store
     simple=shove.store:SimpleStore
+    shm=shove.stores.shm:ShmStore
     sqlite=shove.stores.db:DBStore
     zodb=shove.stores.zodb:ZODBStore
     hg=shove.stores.hgstore:HgStore
@@ -67,7 +69,7 @@ setup(
     firebird=shove.caches.db:DBCache
     memcache=shove.caches.memcached:MemCache
     memlru=shove.cache:MemoryLRUCache
-    memory=shove.caches:MemoryCache
+    memory=shove.cache:MemoryCache
     mssql=shove.caches.db:DBCache
     mysql=shove.caches.db:DBCache
     oracle=shove.caches.db:DBCache
@@ -75,6 +77,7 @@ setup(
     redis=shove.caches.redisdb:RedisCache
     simple=shove.cache:SimpleCache
     simplelru=shove.cache:SimpleLRUCache
+    shm=shove.caches.shm:ShmCache
     sqlite=shove.caches.db:DBCache
     ''',
 )
@@ -2,14 +2,45 @@
 '''shove compatibility shim for different python versions.'''
 
 try:
-    from urlparse import urlsplit
-    from urllib import quote_plus, unquote_plus
+    from urlparse import urlsplit, parse_qsl
+    from urllib import quote_plus, unquote_plus, urlencode
 except ImportError:
-    from urllib.parse import urlsplit, quote_plus, unquote_plus
+    from urllib.parse import (
+        urlsplit, parse_qsl, quote_plus, unquote_plus, urlencode,
+    )
 try:
     from urllib import url2pathname
 except ImportError:
     from urllib.request import url2pathname
+from errno import EPERM
+from threading import Condition, Lock
+try:
+    from threading import get_ident
+except ImportError:
+    from thread import get_ident
+from os import O_RDONLY, close, fsync, getpid, kill, name, open as osopen
+try:
+    from time import perf_counter as clock
+except ImportError:
+    from time import time as clock
+try:
+    from os import replace
+except ImportError:
+    from os import rename as replace
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+try:
+    memoryview = memoryview
+except NameError:
+    # Python 2.6 has no memoryview so no value is ever one
+    class memoryview(object):
+        pass
+try:
+    from collections import OrderedDict
+except ImportError:
+    from ordereddict import OrderedDict
 try:
     import anydbm
 except ImportError:
@@ -37,5 +68,152 @@ def synchronized(func):
     return wrapper
 
 
+def shared(func):
+    '''
+    Decorator to run a method holding its reader-writer lock shared with
+    other readers.
+
+    :argument func: method to decorate
+    '''
+    def wrapper(self, *__args, **__kw):
+        self._lock.acquire_read()
+        try:
+            return func(self, *__args, **__kw)
+        finally:
+            self._lock.release_read()
+    wrapper.__name__ = func.__name__
+    wrapper.__dict__ = func.__dict__
+    wrapper.__doc__ = func.__doc__
+    return wrapper
+
+
+class RWLock(object):
+
+    '''
+    Reentrant lock that readers share and a writer holds alone.
+
+    :meth:`acquire` and :meth:`release` take and drop the writer's side so
+    :func:`synchronized` works with it. A waiting writer goes before new
+    readers, and a thread holding either side may take either side again.
+    '''
+
+    def __init__(self):
+        self._cond = Condition(Lock())
+        # thread -> nested read depth
+        self._readers = dict()
+        self._writer = None
+        self._depth = 0
+        self._waiting = 0
+
+    def acquire_read(self):
+        me = get_ident()
+        cond = self._cond
+        with cond:
+            readers = self._readers
+            if me not in readers and self._writer != me:
+                while self._writer is not None or self._waiting:
+                    cond.wait()
+            readers[me] = readers.get(me, 0) + 1
+
+    def release_read(self):
+        me = get_ident()
+        with self._cond:
+            readers = self._readers
+            depth = readers.pop(me) - 1
+            if depth:
+                readers[me] = depth
+            elif not readers:
+                self._cond.notify_all()
+
+    def acquire(self):
+        me = get_ident()
+        cond = self._cond
+        with cond:
+            if self._writer != me:
+                self._waiting += 1
+                try:
+                    # wait for other writers and for readers but this thread
+                    while self._writer is not None or (
+                        len(self._readers) > (me in self._readers)
+                    ):
+                        cond.wait()
+                finally:
+                    self._waiting -= 1
+                self._writer = me
+            self._depth += 1
+
+    def release(self):
+        with self._cond:
+            self._depth -= 1
+            if not self._depth:
+                self._writer = None
+                self._cond.notify_all()
+
+    __enter__ = acquire
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+def tonative(key, encoding='utf-8'):
+    '''
+    Converts a key returned by a client library to a native string.
+
+    :argument key: byte or native string
+    '''
+    if PY3 and isinstance(key, bytes):
+        return key.decode(encoding)
+    return key
+
+
+def fsyncpath(path):
+    '''
+    Flushes a file or a directory's entries to disk where the platform
+    allows it.
+
+    :argument path: file or directory path
+    '''
+    try:
+        fd = osopen(path, O_RDONLY)
+    except OSError:
+        return
+    try:
+        fsync(fd)
+    except OSError:
+        pass
+    finally:
+        close(fd)
+
+
+def alive(pid):
+    '''
+    Tells whether a process is running (always True on Windows, where
+    signalling a process would end it).
+
+    :argument pid: process id
+    '''
+    if pid == getpid() or name == 'nt':
+        return True
+    try:
+        kill(pid, 0)
+    except OSError as exc:
+        return exc.errno == EPERM
+    return True
+
+
+def unmap(mapped):
+    '''
+    Closes a memory map unless views of it are still alive (such as those
+    held by the traceback of a failed load), in which case it is unmapped
+    once they are collected.
+
+    :argument mapped: memory map
+    '''
+    try:
+        mapped.close()
+    except BufferError:
+        pass
+
+
 def openit(path, mode, encoding='utf-8'):
     return open(path, mode, encoding=encoding) if PY3 else open(path, mode)
@@ -17,8 +17,12 @@ def cache_backend(uri, **kw):
     '''
     Loads the right cache backend based on a URI.
 
-    :argument uri: instance or name :class:`str`
+    :argument uri: instance or name :class:`str` or a list of them for a
+        :class:`shove.cache.TieredCache`
     '''
+    if isinstance(uri, (list, tuple)):
+        from shove.cache import TieredCache
+        return TieredCache((cache_backend(i, **kw) for i in uri), **kw)
     if isinstance(uri, strings):
         mod = caches[uri.split('://', 1)[0]]
         # load module if setuptools not present
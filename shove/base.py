@@ -1,15 +1,32 @@
 # -*- coding: utf-8 -*-
 '''shove core.'''
 
-from functools import partial
-from os.path import exists, join
-from os import listdir, remove, makedirs
-from zlib import compress, decompress, error
+from hashlib import md5
+from copy import deepcopy
+from mmap import mmap, ACCESS_READ
+from itertools import count, islice
+from os.path import dirname, exists, join
+from os import listdir, remove, makedirs, walk, fsync, getpid
+from zlib import decompress, error
 
-from stuf.utils import ld, optimize
-from stuf.six import HIGHEST_PROTOCOL, dumps
+from stuf.utils import ld
+from stuf.six import PY3, items
 
-from shove._compat import url2pathname, quote_plus, unquote_plus
+from shove._compat import (
+    url2pathname, quote_plus, unquote_plus, replace, fsyncpath, pickle,
+    alive, memoryview, unmap,
+)
+from shove.serializers import (
+    HEADER, Dictionaries, Timed, codecs, fastpaths, header, serializers,
+    train,
+)
+
+# suffixes for temporary files (shared so instances never collide)
+_temps = count()
+# values of the durable keyword
+DURABLE = ('none', 'always', 'batch')
+# values of the isolation keyword
+ISOLATION = ('deepcopy', 'frozen', 'serialized')
 
 
 class Base(object):
@@ -17,14 +34,46 @@ class Base(object):
     '''Base for shove.'''
 
     def __init__(self, engine, **kw):
-        # keyword compress True, False, or an integer compression level (1-9)
-        self._compress = kw.get('compress', False)
-        # pickle protocol
-        protocol = kw.get('protocol', HIGHEST_PROTOCOL)
-        if kw.get('optimize', True):
-            self._optimizer = partial(optimize, p=protocol)
-        else:
-            self._optimizer = partial(dumps, protocol=protocol)
+        # keyword compress True, False, or an integer compression level
+        self._compress = compress = kw.get('compress', False)
+        # keyword zdict: directory of trained dictionaries for the 'zdict'
+        # codec (by default stores that can keep them do so themselves)
+        self._zdicts = Dictionaries(kw.get('zdict'))
+        # keyword codec: 'zlib', 'bz2', 'lzma', 'zdict' (Python 3.3+), or
+        # 'lz4' and 'zstd' when their libraries are installed
+        codec = kw.get('codec', 'zlib')
+        if codec not in codecs:
+            raise ValueError(
+                'codec {0} is not available here (try {1})'.format(
+                    codec, ', '.join(sorted(codecs)),
+                )
+            )
+        self._codec = (
+            codecs[codec](
+                None if compress is True else compress, zdicts=self._zdicts,
+            ) if compress else codecs['none']()
+        )
+        # keyword compress_min: values under this many bytes are stored raw
+        self._compress_min = kw.get('compress_min', 64)
+        # keyword serializer: name of a registered serializer (keywords
+        # protocol, optimize, and optimize_max configure pickle)
+        self._serializer = serializers[kw.get('serializer', 'pickle')](**kw)
+        # keyword fastpath: store bytes, text, and int values natively
+        # instead of through the serializer
+        self._fastpaths = dict(
+            (kind, cls()) for kind, cls in items(fastpaths)
+        ) if kw.get('fastpath', True) else dict()
+        # serializers and codecs for reading, by class
+        self._decoders = dict()
+        # keyword timings: record calls and time per serialization phase
+        self._timings = None
+        if kw.get('timings', False):
+            self._timings = dict()
+            self._serializer.timings = self._timings
+            self._serializer = Timed(self._serializer, self._timings)
+            for kind, serializer in items(self._fastpaths):
+                self._fastpaths[kind] = Timed(serializer, self._timings)
+            self._codec = Timed(self._codec, self._timings)
 
     def __contains__(self, key):
         try:
@@ -34,24 +83,198 @@ class Base(object):
         else:
             return True
 
+    def get_many(self, keys):
+        '''
+        Fetches several objects at once.
+
+        :argument keys: iterable of keys
+
+        Returns a :class:`dict` of the keys that were found. Missing keys
+        are left out.
+        '''
+        found = dict()
+        for key in keys:
+            try:
+                found[key] = self[key]
+            except KeyError:
+                pass
+        return found
+
+    def set_many(self, mapping):
+        '''
+        Stores several objects at once.
+
+        :argument mapping: mapping of keys to objects
+        '''
+        for key, value in items(mapping):
+            self[key] = value
+
+    def delete_many(self, keys):
+        '''
+        Removes several objects at once. Missing keys are skipped.
+
+        :argument keys: iterable of keys
+        '''
+        for key in keys:
+            try:
+                del self[key]
+            except KeyError:
+                pass
+
     def dumps(self, value):
-        '''Optionally serializes and compresses object `value`.'''
-        # serialize anything but ASCII strings
-        value = self._optimizer(value)
-        compression = self._compress
-        if compression:
-            value = compress(value, 9 if compression is True else compression)
-        return value
+        '''
+        Serializes and optionally compresses object `value` behind a header
+        byte naming the serializer and codec.
+        '''
+        return b''.join(self._dumpparts(value))
 
     def loads(self, value):
-        '''Deserializes and optionally decompresses object `value`.'''
+        '''
+        Decompresses and deserializes object `value` (bytes or a
+        :class:`memoryview`) with the serializer and codec in its header.
+        '''
+        parts = header(value)
+        if parts is None:
+            return self._legacy(value)
+        serializer, codec, value = parts
+        decoders = self._decoders
+        try:
+            serializer, codec = decoders[serializer], decoders[codec]
+        except KeyError:
+            serializer = decoders.setdefault(
+                serializer, self._timed(serializer()),
+            )
+            codec = decoders.setdefault(
+                codec, self._timed(codec(zdicts=self._zdicts)),
+            )
+        return serializer.loads(codec.decompress(value))
+
+    def timings(self):
+        '''
+        Returns calls and seconds spent in each serialization phase
+        ('serialize', 'optimize', 'compress', 'decompress', 'deserialize')
+        when timings are recorded (keyword `timings=True`).
+        '''
+        return dict(
+            (phase, dict(calls=calls, seconds=seconds))
+            for phase, (calls, seconds) in items(self._timings or {})
+        )
+
+    def train(self, samples=None, size=32768):
+        '''
+        Trains a new dictionary for the 'zdict' codec and returns its version.
+        Later writes use it while values written with older versions stay
+        readable.
+
+        :keyword samples: sample objects (default: up to 1000 stored objects)
+        :keyword size: maximum dictionary size in bytes
+        '''
+        if samples is None:
+            samples = self.get_many(list(islice(self, 1000))).values()
+        dumps = self._serializer.dumps
+        return self._zdicts.add(train([dumps(i) for i in samples], size))
+
+    def _timed(self, coder):
+        # wraps a decoder to record its timings (if enabled)
+        if self._timings is None:
+            return coder
+        return Timed(coder, self._timings)
+
+    def _dumpparts(self, value):
+        # serializes `value` into a list of segments whose concatenation is
+        # its stored form (backends that can write segments one by one skip
+        # joining them)
+        serializer = self._fastpaths.get(type(value), self._serializer)
+        value = serializer.dumps(value)
+        ident = HEADER + serializer.ident * 8
+        # segments with out-of-band buffers are stored uncompressed so they
+        # load without copies
+        if isinstance(value, list):
+            return [bytes(bytearray([ident]))] + value
+        codec = self._codec
+        if codec.ident and len(value) >= self._compress_min:
+            packed = codec.compress(value)
+            # keep the compressed form only when it saves space
+            if len(packed) < len(value):
+                value = packed
+                ident += codec.ident
+        return [bytes(bytearray([ident])), value]
+
+    def _legacy(self, value):
+        # loads values stored before headers were added
         if self._compress:
             try:
                 value = decompress(value)
             except error:
                 pass
+        if isinstance(value, memoryview):
+            # unpickle views directly (ld memoizes on hashable input)
+            if PY3:
+                return pickle.loads(value, encoding='latin-1')
+            value = value.tobytes()
         return ld(value)
 
+    def _loadmap(self, item):
+        # deserializes from file `item` through a read-only memory map
+        # instead of copying the file into a string first
+        try:
+            mapped = mmap(item.fileno(), 0, access=ACCESS_READ)
+        except ValueError:
+            # empty files can't be mapped
+            return self.loads(item.read())
+        try:
+            if not PY3:
+                return self.loads(mapped[:])
+            view = memoryview(mapped)
+            try:
+                return self.loads(view)
+            finally:
+                view.release()
+        finally:
+            unmap(mapped)
+
+
+class Segments(object):
+
+    '''
+    Read-only file over a list of byte segments (as made by
+    :meth:`Base._dumpparts`) for clients that upload from files, so the
+    segments are never joined into one string.
+    '''
+
+    def __init__(self, parts):
+        self._parts = list(memoryview(part).cast('B') for part in parts)
+        self._size = sum(len(part) for part in self._parts)
+        self._position = 0
+
+    def __len__(self):
+        return self._size
+
+    def read(self, size=-1):
+        start = self._position
+        end = self._size if size < 0 else min(self._size, start + size)
+        chunks, offset = [], 0
+        for part in self._parts:
+            if offset >= end:
+                break
+            stop = offset + len(part)
+            if stop > start:
+                chunks.append(part[max(start - offset, 0):end - offset])
+            offset = stop
+        self._position = end
+        return b''.join(chunks)
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self._position
+        elif whence == 2:
+            offset += self._size
+        self._position = max(0, offset)
+        return self._position
+
+    def tell(self):
+        return self._position
+
 
 class Mapping(Base):
 
@@ -79,51 +302,186 @@ class Mapping(Base):
         return len(self._store)
 
 
+class Isolated(Base):
+
+    '''
+    Base for in-memory storage that keeps stored values apart from the
+    objects callers hold. The `isolation` keyword picks how:
+
+    - 'deepcopy' (default): reads return a deep copy of the stored object
+    - 'frozen': reads return the stored object itself, so neither the
+      writer nor readers may mutate it
+    - 'serialized': values are stored serialized and loaded on each read,
+      which is usually faster than a deep copy of a nested value
+    '''
+
+    def __init__(self, engine, **kw):
+        super(Isolated, self).__init__(engine, **kw)
+        self._isolation = kw.get('isolation', 'deepcopy')
+        if self._isolation not in ISOLATION:
+            raise ValueError(
+                'isolation must be one of {0}'.format(', '.join(ISOLATION))
+            )
+
+    def _pack(self, value):
+        # value as stored
+        if self._isolation == 'serialized':
+            return self.dumps(value)
+        return value
+
+    def _unpack(self, value):
+        # value as handed to a reader
+        isolation = self._isolation
+        if isolation == 'deepcopy':
+            return deepcopy(value)
+        if isolation == 'serialized':
+            return self.loads(value)
+        return value
+
+
 class FileBase(Base):
 
-    '''Base for file based storage.'''
+    '''
+    Base for file based storage.
+
+    Writes go through a temporary file renamed into place so readers never
+    see a partial value. Keywords:
+
+    - `fanout`: levels of hashed subdirectories to spread files over (the
+      default, 0, keeps every file in one flat directory)
+    - `manifest`: keep a journal of keys so `len`, membership, and
+      iteration don't scan the directory (assumes one writing process)
+    - `durable`: 'none' (the default) leaves flushing to the OS, 'always'
+      fsyncs every write, 'batch' fsyncs the files and directories a
+      `set_many` or `delete_many` batch changed once the batch ends
+    - `mmap`: read values through a memory map
+    '''
 
     def __init__(self, engine, **kw):
         super(FileBase, self).__init__(engine, **kw)
         if engine.startswith(self.init):
             engine = url2pathname(engine.split('://')[1])
         self._dir = engine
+        if self._zdicts.path is None:
+            self._zdicts.path = join(engine, '.zdict')
+        # keywords are described in the class docstring
+        self._fanout = kw.get('fanout', 0)
+        self._durable = kw.get('durable', 'none')
+        if self._durable not in DURABLE:
+            raise ValueError(
+                'durable must be one of {0}'.format(', '.join(DURABLE))
+            )
+        self._mmap = kw.get('mmap', False)
+        # directories and files awaiting fsync in the current batch
+        self._pending = None
+        self._unsynced = None
+        # in-memory key index backed by the manifest (if enabled)
+        self._keys = None
+        self._manifest = None
         # Create directory
         if not exists(self._dir):
             self._createdir()
+        else:
+            self._sweep()
+        if kw.get('manifest', False):
+            self._openmanifest()
 
     def __getitem__(self, key):
         # (per Larry Meyn)
         try:
             with open(self._key_to_file(key), 'rb') as item:
+                if self._mmap:
+                    return self._loadmap(item)
                 return self.loads(item.read())
         except (IOError, OSError):
             raise KeyError(key)
 
     def __setitem__(self, key, value):
         # (per Larry Meyn)
+        value = self._dumpparts(value)
         try:
-            with open(self._key_to_file(key), 'wb') as item:
-                item.write(self.dumps(value))
+            folders = self._write(self._key_to_file(key), value)
         except (IOError, OSError):
             raise KeyError(key)
+        keys = self._keys
+        if keys is not None and key not in keys:
+            keys.add(key)
+            self._record('+', key)
+        self._commit(folders)
 
     def __delitem__(self, key):
+        path = self._key_to_file(key)
         try:
-            remove(self._key_to_file(key))
+            remove(path)
         except (IOError, OSError):
             raise KeyError(key)
+        keys = self._keys
+        if keys is not None and key in keys:
+            keys.discard(key)
+            self._record('-', key)
+        self._commit([dirname(path)])
 
     def __iter__(self):
-        for name in listdir(self._dir):
-            if not name.startswith('.'):
-                yield unquote_plus(name)
+        if self._keys is not None:
+            return iter(list(self._keys))
+        return (unquote_plus(name) for name in self._names())
 
     def __contains__(self, key):
+        if self._keys is not None:
+            return key in self._keys
         return exists(self._key_to_file(key))
 
     def __len__(self):
-        return len([i for i in listdir(self._dir) if not i.startswith('.')])
+        if self._keys is not None:
+            return len(self._keys)
+        return sum(1 for _ in self._names())
+
+    def set_many(self, mapping):
+        '''
+        Stores several objects at once.
+
+        :argument mapping: mapping of keys to objects
+        '''
+        self._batch(super(FileBase, self).set_many, mapping)
+
+    def delete_many(self, keys):
+        '''
+        Removes several objects at once. Missing keys are skipped.
+
+        :argument keys: iterable of keys
+        '''
+        self._batch(super(FileBase, self).delete_many, keys)
+
+    def close(self):
+        '''Compacts and closes the manifest.'''
+        self._closemanifest()
+        try:
+            close = super(FileBase, self).close
+        except AttributeError:
+            pass
+        else:
+            close()
+
+    def _batch(self, method, argument):
+        # defers directory fsyncs to the end of a batch in 'batch' mode
+        if self._durable != 'batch' or self._pending is not None:
+            return method(argument)
+        self._pending = pending = set()
+        self._unsynced = unsynced = list()
+        try:
+            method(argument)
+        finally:
+            self._pending = self._unsynced = None
+            for path in unsynced:
+                fsyncpath(path)
+            self._sync(pending)
+
+    def _commit(self, folders):
+        # makes renames and removals in `folders` durable
+        if self._pending is not None:
+            self._pending.update(folders)
+        elif self._durable != 'none':
+            self._sync(folders)
 
     def _createdir(self):
         # creates the store directory
@@ -137,4 +495,152 @@ class FileBase(Base):
 
     def _key_to_file(self, key):
         # gives the filesystem path for a key
-        return join(self._dir, quote_plus(key))
+        name = quote_plus(key)
+        fanout = self._fanout
+        if not fanout:
+            return join(self._dir, name)
+        digest = md5(name.encode('utf-8')).hexdigest()
+        return join(
+            self._dir,
+            *[digest[i:i + 2] for i in range(0, 2 * fanout, 2)] + [name]
+        )
+
+    def _names(self):
+        # walks the directory for stored file names, skipping dotfiles
+        if not self._fanout:
+            for name in listdir(self._dir):
+                if not name.startswith('.'):
+                    yield name
+        else:
+            for _, dirs, names in walk(self._dir):
+                dirs[:] = [i for i in dirs if not i.startswith('.')]
+                for name in names:
+                    if not name.startswith('.'):
+                        yield name
+
+    def _sweep(self):
+        # removes temporary files left by writers that died mid-write
+        for folder, dirs, names in walk(self._dir):
+            dirs[:] = [i for i in dirs if not i.startswith('.')]
+            for name in names:
+                if name.startswith('.') and name.endswith('.tmp'):
+                    try:
+                        pid = int(name.split('.')[1])
+                    except ValueError:
+                        continue
+                    if not alive(pid):
+                        try:
+                            remove(join(folder, name))
+                        except OSError:
+                            pass
+
+    def _sync(self, folders):
+        # fsyncs the manifest and directories holding changed entries
+        if self._manifest is not None:
+            self._manifest.flush()
+            fsync(self._manifest.fileno())
+        for folder in folders:
+            fsyncpath(folder)
+
+    def _write(self, path, value):
+        # writes a list of segments to a temporary file renamed over `path`
+        # so readers never see a partial value, returning the directories
+        # that changed
+        folder = dirname(path)
+        temp = join(folder, '.{0}.{1}.tmp'.format(getpid(), next(_temps)))
+        folders = [folder]
+        try:
+            item = open(temp, 'wb')
+        except (IOError, OSError):
+            if not self._fanout:
+                raise
+            try:
+                makedirs(folder)
+            except OSError:
+                pass
+            # new fan-out directories must be synced in their parents too
+            for _ in range(self._fanout):
+                folders.append(dirname(folders[-1]))
+            item = open(temp, 'wb')
+        try:
+            with item:
+                item.writelines(value)
+                # files written in a batch are synced when it ends
+                if self._durable != 'none' and self._unsynced is None:
+                    item.flush()
+                    fsync(item.fileno())
+            replace(temp, path)
+            if self._unsynced is not None:
+                self._unsynced.append(path)
+        except:
+            try:
+                remove(temp)
+            except OSError:
+                pass
+            raise
+        return folders
+
+    def _openmanifest(self):
+        # loads the key manifest, building it from the directory if missing
+        path = join(self._dir, '.manifest')
+        if exists(path):
+            keys, logged, torn = self._readmanifest(path)
+        else:
+            keys = set(unquote_plus(name) for name in self._names())
+            logged, torn = 0, False
+        self._keys = keys
+        self._logged = logged
+        # only instances that recorded changes rewrite the manifest on close
+        self._written = False
+        if torn or not logged or logged > 2 * len(keys) + 1024:
+            self._compact()
+        else:
+            self._manifest = open(path, 'a')
+
+    def _readmanifest(self, path):
+        # replays the manifest into a set of keys
+        keys = set()
+        logged = 0
+        torn = False
+        with open(path) as manifest:
+            for line in manifest:
+                # skip a record torn by a crash mid-write
+                if not line.endswith('\n'):
+                    torn = True
+                    break
+                logged += 1
+                if line[0] == '+':
+                    keys.add(unquote_plus(line[1:-1]))
+                else:
+                    keys.discard(unquote_plus(line[1:-1]))
+        return keys, logged, torn
+
+    def _closemanifest(self):
+        if self._manifest is not None:
+            if self._written:
+                self._compact()
+            self._manifest.close()
+            self._manifest = None
+
+    def _compact(self):
+        # rewrites the manifest with one record per live key, first picking
+        # up records appended by other instances
+        path = join(self._dir, '.manifest')
+        if self._manifest is not None:
+            self._manifest.close()
+            self._keys = self._readmanifest(path)[0]
+        with open(path + '.tmp', 'w') as manifest:
+            for key in self._keys:
+                manifest.write('+{0}\n'.format(quote_plus(key)))
+        replace(path + '.tmp', path)
+        self._logged = len(self._keys)
+        self._manifest = open(path, 'a')
+
+    def _record(self, op, key):
+        # appends one record to the manifest
+        self._manifest.write('{0}{1}\n'.format(op, quote_plus(key)))
+        self._manifest.flush()
+        self._written = True
+        self._logged += 1
+        if self._logged > 2 * len(self._keys) + 1024:
+            self._compact()
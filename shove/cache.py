@@ -5,71 +5,468 @@ shove cache core
 
 import random
 from time import time
+from functools import partial
+from itertools import count
 from copy import deepcopy
-from collections import deque
 from threading import Condition
+from heapq import heapify, heappop, heappush
+from os.path import getmtime, getsize
 
-from shove._compat import synchronized
-from shove.base import Mapping, FileBase
+from stuf.six import items
+
+from shove._compat import OrderedDict, pickle, synchronized
+from shove.base import Isolated, Mapping, FileBase
 
 __all__ = [
     'FileCache', 'FileLRUCache', 'MemoryCache', 'MemoryLRUCache',
-    'SimpleLRUCache', 'SimpleCache',
+    'SimpleLRUCache', 'SimpleCache', 'TieredCache',
 ]
 
 
+class ExpiryIndex(object):
+
+    '''
+    Index of keys by expiration time.
+
+    A heap with lazy deletion: adding, replacing and removing a key or
+    popping the key that expires soonest are all O(log n).
+    '''
+
+    def __init__(self):
+        self._heap = list()
+        # key -> [expiration time, sequence number, key] heap entry
+        self._entries = dict()
+        # tie breaker for keys with the same expiration time
+        self._counter = count()
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, key, expires):
+        '''
+        Adds or moves `key` in the index.
+
+        :argument key: key
+        :argument expires: expiration time
+        '''
+        self.discard(key)
+        entry = self._entries[key] = [expires, next(self._counter), key]
+        heappush(self._heap, entry)
+
+    def discard(self, key):
+        '''Removes `key` if it is present.'''
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            # leave a tombstone in the heap
+            entry[2] = None
+            # rebuild once tombstones outnumber live entries
+            heap = self._heap
+            if len(heap) > 2 * len(self._entries) + 64:
+                heap[:] = list(e for e in heap if e[2] is not None)
+                heapify(heap)
+
+    def expired(self, now, limit):
+        '''
+        Removes and returns up to `limit` keys that expired before `now`.
+        '''
+        heap, keys = self._heap, list()
+        while heap and len(keys) < limit:
+            expires, _, key = heap[0]
+            if key is None:
+                heappop(heap)
+            elif expires < now:
+                keys.append(self.pop())
+            else:
+                break
+        return keys
+
+    def pop(self):
+        '''Removes and returns the key that expires soonest.'''
+        heap = self._heap
+        while heap:
+            key = heappop(heap)[2]
+            if key is not None:
+                del self._entries[key]
+                return key
+        raise KeyError('empty')
+
+
+class RandomPolicy(object):
+
+    '''Evicts keys at random in O(1).'''
+
+    def __init__(self):
+        self._keys = list()
+        # key -> position in the key list
+        self._positions = dict()
+
+    def __contains__(self, key):
+        return key in self._positions
+
+    def __len__(self):
+        return len(self._keys)
+
+    def add(self, key):
+        if key not in self._positions:
+            self._positions[key] = len(self._keys)
+            self._keys.append(key)
+
+    def touch(self, key):
+        pass
+
+    def discard(self, key):
+        position = self._positions.pop(key, None)
+        if position is not None:
+            # move the last key into the hole
+            keys = self._keys
+            last = keys.pop()
+            if last != key:
+                keys[position] = last
+                self._positions[last] = position
+
+    def pop(self):
+        if not self._keys:
+            raise KeyError('empty')
+        key = random.choice(self._keys)
+        self.discard(key)
+        return key
+
+
+class LRUPolicy(object):
+
+    '''
+    Linked hash map that evicts the least recently used key.
+
+    Every operation is O(1).
+    '''
+
+    def __init__(self):
+        # circular doubly linked list around a sentinel where each link is
+        # [previous link, next link, key]
+        self._root = root = list()
+        root[:] = [root, root, None]
+        self._links = dict()
+
+    def __contains__(self, key):
+        return key in self._links
+
+    def __len__(self):
+        return len(self._links)
+
+    def add(self, key):
+        if key in self._links:
+            self.touch(key)
+        else:
+            root = self._root
+            last = root[0]
+            last[1] = root[0] = self._links[key] = [last, root, key]
+
+    def touch(self, key):
+        link = self._links.get(key)
+        if link is not None:
+            prev, nxt, root = link[0], link[1], self._root
+            # unlink...
+            prev[1], nxt[0] = nxt, prev
+            # ...and relink before the sentinel
+            last = root[0]
+            link[0], link[1] = last, root
+            last[1] = root[0] = link
+
+    def discard(self, key):
+        link = self._links.pop(key, None)
+        if link is not None:
+            prev, nxt = link[0], link[1]
+            prev[1], nxt[0] = nxt, prev
+
+    def pop(self):
+        link = self._root[1]
+        if link is self._root:
+            raise KeyError('empty')
+        self.discard(link[2])
+        return link[2]
+
+
+class LFUPolicy(object):
+
+    '''
+    Evicts the least frequently used key, oldest first among equals.
+
+    Keys are kept in insertion-ordered buckets, one per use count, linked in
+    ascending use count order so adding, touching and evicting are O(1).
+    '''
+
+    def __init__(self):
+        # key -> bucket
+        self._buckets = dict()
+        # circular doubly linked list of buckets around a sentinel where each
+        # bucket is [previous bucket, next bucket, use count, ordered keys]
+        self._root = root = list()
+        root[:] = [root, root, 0, None]
+
+    def __contains__(self, key):
+        return key in self._buckets
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def _bucket(self, prev, uses):
+        # links an empty bucket for `uses` after `prev`
+        nxt = prev[1]
+        bucket = prev[1] = nxt[0] = [prev, nxt, uses, OrderedDict()]
+        return bucket
+
+    def _unlink(self, key, bucket):
+        keys = bucket[3]
+        del keys[key]
+        if not keys:
+            prev, nxt = bucket[0], bucket[1]
+            prev[1], nxt[0] = nxt, prev
+
+    def add(self, key):
+        if key in self._buckets:
+            self.touch(key)
+        else:
+            root = self._root
+            bucket = root[1]
+            if bucket[2] != 1:
+                bucket = self._bucket(root, 1)
+            bucket[3][key] = None
+            self._buckets[key] = bucket
+
+    def touch(self, key):
+        bucket = self._buckets.get(key)
+        if bucket is not None:
+            uses = bucket[2] + 1
+            nxt = bucket[1]
+            if nxt[2] != uses:
+                nxt = self._bucket(bucket, uses)
+            nxt[3][key] = None
+            self._buckets[key] = nxt
+            self._unlink(key, bucket)
+
+    def discard(self, key):
+        bucket = self._buckets.pop(key, None)
+        if bucket is not None:
+            self._unlink(key, bucket)
+
+    def pop(self):
+        # the first bucket has the lowest use count
+        bucket = self._root[1]
+        if bucket is self._root:
+            raise KeyError('empty')
+        key = next(iter(bucket[3]))
+        self.discard(key)
+        return key
+
+
+class TTLPolicy(object):
+
+    '''Evicts the key that expires soonest.'''
+
+    def __init__(self, expiry):
+        # shares the cache's expiry index
+        self._expiry = expiry
+
+    def __contains__(self, key):
+        return key in self._expiry
+
+    def __len__(self):
+        return len(self._expiry)
+
+    def add(self, key):
+        pass
+
+    def touch(self, key):
+        pass
+
+    def discard(self, key):
+        pass
+
+    def pop(self):
+        return self._expiry.pop()
+
+
+# eviction policies by name
+policies = dict(
+    random=RandomPolicy, lru=LRUPolicy, lfu=LFUPolicy, ttl=TTLPolicy,
+)
+
+
 class BaseCache(object):
 
+    # default eviction policy
+    policy = 'random'
+
     def __init__(self, engine, **kw):
         super(BaseCache, self).__init__(engine, **kw)
         # get random seed
         random.seed()
-        # set maximum number of items to cull if over max
+        # set maximum number of expired items to remove per cull
         self._maxcull = kw.get('maxcull', 10)
         # set max entries
         self._max_entries = kw.get('max_entries', 300)
+        # optional budget for the total pickled size of all entries
+        self._max_bytes = kw.get('max_bytes')
+        # callable measuring an entry's value for the byte budget
+        self._sizer = kw.get('sizer')
+        # callable taking the key and value of each entry the eviction
+        # policy removes
+        self.evicted = kw.get('evicted')
         # set timeout
         self.timeout = kw.get('timeout', 300)
+        # seconds an expired entry may still be served while one reader
+        # reloads it (stale-while-revalidate)
+        self._stale = kw.get('stale', 0)
+        # expired keys a reader is reloading
+        self._revalidating = set()
+        # index of keys by expiration time
+        self._expiry = ExpiryIndex()
+        # eviction policy: 'random', 'lru', 'lfu', or 'ttl'
+        policy = policies[kw.get('policy', self.policy)]
+        self._policy = (
+            policy(self._expiry) if policy is TTLPolicy else policy()
+        )
+        # byte size of entries when there is a byte budget
+        self._sizes = dict()
+        self._bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
 
     def __getitem__(self, key):
-        exp, value = super(BaseCache, self).__getitem__(key)
-        # delete if item timed out.
-        if exp < time():
-            super(BaseCache, self).__delitem__(key)
-            raise KeyError(key)
+        try:
+            exp, value = super(BaseCache, self).__getitem__(key)
+        except KeyError:
+            self._misses += 1
+            self._forget(key)
+            raise
+        now = time()
+        if exp < now:
+            # delete if item timed out.
+            if exp + self._stale < now:
+                self._misses += 1
+                self._remove(key)
+                raise KeyError(key)
+            # the first reader misses and reloads the entry while the others
+            # get the stale value
+            if key not in self._revalidating:
+                self._misses += 1
+                self._revalidating.add(key)
+                raise KeyError(key)
+        self._hits += 1
+        self._policy.touch(key)
         return value
 
     def __setitem__(self, key, value):
-        # cull values if over max number of entries
-        if len(self) >= self._max_entries:
+        self.set(key, value)
+
+    def set(self, key, value, ttl=None):
+        '''
+        Stores an object that expires after `ttl` seconds.
+
+        :argument key: key
+        :argument value: object
+        :argument ttl: seconds the object is kept (default the timeout)
+        '''
+        # make room if at maximum number of entries
+        if key not in self._expiry and len(self) >= self._max_entries:
             self._cull()
         # set expiration time and value
-        exp = time() + self.timeout
+        exp = time() + (self.timeout if ttl is None else ttl)
         super(BaseCache, self).__setitem__(key, (exp, value))
+        self._revalidating.discard(key)
+        max_bytes = self._max_bytes
+        if max_bytes is not None:
+            self._resize(key, self._sizeof(key, value))
+            if self._bytes > max_bytes:
+                # only evict other entries to make room for this one
+                self._expiry.discard(key)
+                self._policy.discard(key)
+                while self._bytes > max_bytes and len(self):
+                    self._evict()
+        self._track(key, exp)
+
+    def __delitem__(self, key):
+        super(BaseCache, self).__delitem__(key)
+        self._forget(key)
+
+    def __len__(self):
+        return len(self._expiry)
 
     def _cull(self):
-        num = 0
-        # remove items in cache to make room
-        maxcull = self._maxcull
-        # cull number of items allowed (set by self._maxcull)
-        for num, key in enumerate(self):
-            # remove only maximum # of items allowed by maxcull
-            if num <= maxcull:
-                # remove items if expired
-                try:
-                    self[key]
-                except KeyError:
-                    num += 1
-            else:
-                break
-        choice = random.choice
-        keys = list(self)
-        max_entries = self._max_entries
-        # remove any additional items up to max # of items allowed by maxcull
-        while len(self) >= max_entries and num <= maxcull:
-            # cull remainder of allowed quota at random
-            del self[choice(keys)]
-            num += 1
+        # remove entries that timed out first
+        remove = self._remove
+        for key in self._expiry.expired(time() - self._stale, self._maxcull):
+            remove(key)
+        # then evict by policy until there is room
+        while len(self) >= self._max_entries:
+            self._evict()
+
+    def _evict(self):
+        # removes the entry picked by the eviction policy
+        key, evicted = self._policy.pop(), self.evicted
+        if evicted is not None:
+            try:
+                value = self._peek(key)
+            except KeyError:
+                evicted = None
+        self._remove(key)
+        self._evictions += 1
+        if evicted is not None:
+            evicted(key, value)
+
+    def _forget(self, key):
+        # drops a key from the indexes
+        self._expiry.discard(key)
+        self._revalidating.discard(key)
+        self._policy.discard(key)
+        if self._sizes:
+            self._bytes -= self._sizes.pop(key, 0)
+
+    def _peek(self, key):
+        # stored value of an entry without touching the indexes
+        return super(BaseCache, self).__getitem__(key)[1]
+
+    def _remove(self, key):
+        # removes an entry from storage and the indexes
+        try:
+            super(BaseCache, self).__delitem__(key)
+        except KeyError:
+            pass
+        self._forget(key)
+
+    def _resize(self, key, size):
+        # records the byte size of an entry
+        self._bytes += size - self._sizes.get(key, 0)
+        self._sizes[key] = size
+
+    def _sizeof(self, key, value):
+        # byte size of an entry (pickled size without compression unless a
+        # sizer was supplied)
+        if self._sizer is not None:
+            return self._sizer(value)
+        return len(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+
+    def _track(self, key, exp):
+        # adds a key to the indexes
+        self._expiry.add(key, exp)
+        self._policy.add(key)
+
+    def stats(self):
+        '''
+        Returns the hit, miss and eviction counters plus the number of
+        entries and, when `max_bytes` is set, their total byte size.
+        '''
+        return dict(
+            hits=self._hits,
+            misses=self._misses,
+            evictions=self._evictions,
+            entries=len(self),
+            bytes=self._bytes,
+        )
 
 
 class SimpleCache(BaseCache, Mapping):
@@ -87,7 +484,7 @@ class SimpleCache(BaseCache, Mapping):
         self._store = dict()
 
 
-class MemoryCache(SimpleCache):
+class MemoryCache(Isolated, SimpleCache):
 
     '''
     Thread-safe in-memory cache.
@@ -95,18 +492,51 @@ class MemoryCache(SimpleCache):
     The shove URI for a memory cache is:
 
     memory://
+
+    See :class:`shove.base.Isolated` for the `isolation` keyword.
     '''
 
     def __init__(self, engine, **kw):
         super(MemoryCache, self).__init__(engine, **kw)
         self._lock = Condition()
 
-    @synchronized
     def __getitem__(self, key):
-        return deepcopy(super(MemoryCache, self).__getitem__(key))
+        # reads update the eviction indexes so they hold the lock, but the
+        # copy is made after releasing it
+        with self._lock:
+            value = super(MemoryCache, self).__getitem__(key)
+        return self._unpack(value)
+
+    def set(self, key, value, ttl=None):
+        value = self._pack(value)
+        with self._lock:
+            super(MemoryCache, self).set(key, value, ttl)
+
+    def _peek(self, key):
+        return self._unpack(super(MemoryCache, self)._peek(key))
+
+    def get_many(self, keys):
+        '''
+        Fetches several objects at once.
+
+        :argument keys: iterable of keys
+        '''
+        getitem, found = super(MemoryCache, self).__getitem__, dict()
+        with self._lock:
+            for key in keys:
+                try:
+                    found[key] = getitem(key)
+                except KeyError:
+                    pass
+        if self._isolation == 'deepcopy':
+            # one copy keeps objects shared between values shared
+            return deepcopy(found)
+        unpack = self._unpack
+        return dict((k, unpack(v)) for k, v in items(found))
 
-    __setitem__ = synchronized(SimpleCache.__setitem__)
     __delitem__ = synchronized(SimpleCache.__delitem__)
+    set_many = synchronized(SimpleCache.set_many)
+    delete_many = synchronized(SimpleCache.delete_many)
 
 
 class FileCache(BaseCache, FileBase):
@@ -121,83 +551,48 @@ class FileCache(BaseCache, FileBase):
     Where the path is a URI path to a directory on a local filesystem.
     Alternatively, a native pathname to the directory can be passed as the
     'engine' argument.
+
+    The expiry and eviction indexes are built from the directory when the
+    cache opens and afterwards only track this instance's writes, so a file
+    cache is meant for a single process.
+
+    See :class:`shove.base.FileBase` for the `fanout`, `manifest`,
+    `durable`, and `mmap` keywords.
     '''
 
     init = 'file://'
 
     def __init__(self, engine, **kw):
         super(FileCache, self).__init__(engine, **kw)
+        # index entries left by earlier instances (reads still check the
+        # stored expiration time)
+        sizeof = self._max_bytes is not None
+        for key in self:
+            path = self._key_to_file(key)
+            try:
+                self._track(key, getmtime(path) + self.timeout)
+                if sizeof:
+                    self._resize(key, getsize(path))
+            except OSError:
+                pass
 
     def __getitem__(self, key):
         try:
-            exp, value = super(FileCache, self).__getitem__(key)
-            # remove item if time has expired.
-            if exp < time():
-                del self[key]
-                raise KeyError(key)
-            return value
+            return super(FileCache, self).__getitem__(key)
         except:
             raise KeyError(key)
 
-    def __setitem__(self, key, value):
-        if len(self) >= self._max_entries:
-            self._cull()
-        super(FileCache, self).__setitem__(
-            key, (time() + self.timeout, value)
-        )
-
-
-class BaseLRUCache(BaseCache):
-
-    def __init__(self, engine, **kw):
-        super(BaseLRUCache, self).__init__(engine, **kw)
-        self._max_entries = kw.get('max_entries', 300)
-        self._hits = 0
-        self._misses = 0
-        self._queue = deque()
-        self._refcount = dict()
-
-    def __getitem__(self, key):
+    def _sizeof(self, key, value):
+        # the entry was just written so its file size is the stored size
+        if self._sizer is not None:
+            return self._sizer(value)
         try:
-            value = super(BaseLRUCache, self).__getitem__(key)
-            self._hits += 1
-        except KeyError:
-            self._misses += 1
-            raise
-        self._housekeep(key)
-        return value
+            return getsize(self._key_to_file(key))
+        except OSError:
+            return 0
 
-    def __setitem__(self, key, value):
-        super(BaseLRUCache, self).__setitem__(key, value)
-        self._housekeep(key)
-        if len(self) > self._max_entries:
-            queue = self._queue
-            store = self
-            max_entries = self._max_entries
-            refcount = self._refcount
-            delitem = super(BaseLRUCache, self).__delitem__
-            while len(store) > max_entries:
-                k = queue.popleft()
-                refcount[k] -= 1
-                if not refcount[k]:
-                    delitem(k)
-                    del refcount[k]
-
-    def _housekeep(self, key):
-        self._queue.append(key)
-        self._refcount[key] = self._refcount.get(key, 0) + 1
-        if len(self._queue) > self._max_entries * 4:
-            queue = self._queue
-            refcount = self._refcount
-            for _ in [None] * len(queue):
-                k = queue.popleft()
-                if refcount[k] == 1:
-                    queue.append(k)
-                else:
-                    refcount[k] -= 1
 
-
-class SimpleLRUCache(BaseLRUCache, Mapping):
+class SimpleLRUCache(SimpleCache):
 
     '''
     Single-process in-memory LRU cache that purges based on least recently
@@ -208,12 +603,10 @@ class SimpleLRUCache(BaseLRUCache, Mapping):
     simplelru://
     '''
 
-    def __init__(self, engine, **kw):
-        super(SimpleLRUCache, self).__init__(engine, **kw)
-        self._store = dict()
+    policy = 'lru'
 
 
-class MemoryLRUCache(SimpleLRUCache):
+class MemoryLRUCache(MemoryCache):
 
     '''
     Thread-safe in-memory cache using LRU.
@@ -223,19 +616,10 @@ class MemoryLRUCache(SimpleLRUCache):
     memlru://
     '''
 
-    def __init__(self, engine, **kw):
-        super(MemoryLRUCache, self).__init__(engine, **kw)
-        self._lock = Condition()
-
-    @synchronized
-    def __getitem__(self, key):
-        return deepcopy(super(MemoryLRUCache, self).__getitem__(key))
+    policy = 'lru'
 
-    __setitem__ = synchronized(SimpleLRUCache.__setitem__)
-    __delitem__ = synchronized(SimpleLRUCache.__delitem__)
 
-
-class FileLRUCache(BaseLRUCache, FileBase):
+class FileLRUCache(FileCache):
 
     '''
     File-based LRU cache
@@ -250,6 +634,170 @@ class FileLRUCache(BaseLRUCache, FileBase):
     '''
 
     init = 'filelru://'
+    policy = 'lru'
 
-    def __init__(self, engine, **kw):
-        super(FileLRUCache, self).__init__(engine, **kw)
+
+class TieredCache(object):
+
+    '''
+    Chain of caches tried in order, such as an in-process `memlru://` cache
+    in front of a shared `redis://` cache.
+
+    Pass a list of cache URIs or instances as the cache to
+    :class:`shove.Shove`. Keywords:
+
+    - `tier_timeouts`: timeout of each tier (None keeps the tier's own)
+    - `promote`: hits in a lower tier after which a key is copied into the
+      tiers above it (default 1; 0 never copies)
+    - `demote`: write to the first tier only and move entries a tier's
+      eviction policy removes into the next tier (the in-process and file
+      caches evict by policy) instead of writing to every tier
+    '''
+
+    def __init__(self, tiers, **kw):
+        self._tiers = tiers = list(tiers)
+        for tier, timeout in zip(tiers, kw.get('tier_timeouts') or ()):
+            if timeout is not None:
+                tier.timeout = timeout
+        self._promote = kw.get('promote', 1)
+        self._demote = kw.get('demote', False)
+        if self._demote:
+            for index, tier in enumerate(tiers[:-1]):
+                if hasattr(tier, 'evicted'):
+                    tier.evicted = partial(self._demoted, index + 1)
+        # lower-tier hits of keys waiting for promotion (oldest dropped first)
+        self._counts = OrderedDict()
+        self._hits = list(0 for _ in tiers)
+        self._misses = list(0 for _ in tiers)
+        self._promotions = self._demotions = 0
+
+    def __contains__(self, key):
+        try:
+            self[key]
+        except KeyError:
+            return False
+        return True
+
+    def __getitem__(self, key):
+        for index, tier in enumerate(self._tiers):
+            try:
+                value = tier[key]
+            except KeyError:
+                self._misses[index] += 1
+                continue
+            self._hits[index] += 1
+            if index:
+                self._promoting(index, {key: value})
+            return value
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        self.set(key, value)
+
+    def set(self, key, value, ttl=None):
+        '''
+        Stores an object that every tier written to keeps for `ttl` seconds.
+
+        :argument key: key
+        :argument value: object
+        :argument ttl: seconds the object is kept (default each tier's
+            timeout)
+        '''
+        for tier in self._writable():
+            tier.set(key, value, ttl)
+
+    def __delitem__(self, key):
+        for tier in self._tiers:
+            try:
+                del tier[key]
+            except KeyError:
+                pass
+
+    def get_many(self, keys):
+        '''
+        Fetches several objects at once, asking each tier for the keys the
+        tiers before it missed.
+
+        :argument keys: iterable of keys
+        '''
+        found, keys = dict(), list(keys)
+        for index, tier in enumerate(self._tiers):
+            if not keys:
+                break
+            hits = tier.get_many(keys)
+            self._hits[index] += len(hits)
+            self._misses[index] += len(keys) - len(hits)
+            if hits:
+                if index:
+                    self._promoting(index, hits)
+                found.update(hits)
+                keys = list(key for key in keys if key not in hits)
+        return found
+
+    def set_many(self, mapping):
+        '''
+        Stores several objects at once.
+
+        :argument mapping: mapping of keys to objects
+        '''
+        for tier in self._writable():
+            tier.set_many(mapping)
+
+    def delete_many(self, keys):
+        '''
+        Removes several objects at once. Missing keys are skipped.
+
+        :argument keys: iterable of keys
+        '''
+        keys = list(keys)
+        for tier in self._tiers:
+            tier.delete_many(keys)
+
+    def stats(self):
+        '''
+        Returns the promotion and demotion counters plus the hits and
+        misses of each tier (and the tier's own statistics if it keeps any).
+        '''
+        tiers = list()
+        for index, tier in enumerate(self._tiers):
+            stats = dict(hits=self._hits[index], misses=self._misses[index])
+            if hasattr(tier, 'stats'):
+                stats['cache'] = tier.stats()
+            tiers.append(stats)
+        return dict(
+            tiers=tiers,
+            promotions=self._promotions,
+            demotions=self._demotions,
+        )
+
+    def _demoted(self, index, key, value):
+        # moves an entry evicted from one tier into the tier at `index`
+        self._tiers[index][key] = value
+        self._demotions += 1
+
+    def _promoting(self, index, hits):
+        # copies objects found in the tier at `index` into the tiers above
+        promote = self._promote
+        if not promote:
+            return
+        if promote > 1:
+            counts, ready = self._counts, dict()
+            for key, value in items(hits):
+                uses = counts.pop(key, 0) + 1
+                if uses >= promote:
+                    ready[key] = value
+                else:
+                    counts[key] = uses
+            # only remember recent keys
+            while len(counts) > 4096:
+                counts.popitem(last=False)
+            hits = ready
+        if hits:
+            tiers = self._tiers[:1] if self._demote else self._tiers[:index]
+            for tier in tiers:
+                tier.set_many(hits)
+            self._promotions += len(hits)
+
+    def _writable(self):
+        # tiers that writes go to
+        return self._tiers[:1] if self._demote else self._tiers
@@ -15,6 +15,9 @@ sqlite, mysql, postgres, oracle, mssql, and firebird.
 <port> is the database port
 <database> is the name of the specific database
 
+Connection pooling is configured the same way as for
+:class:`shove.stores.db.DBStore`.
+
 For more information on specific databases see:
 
 http://www.sqlalchemy.org/docs/dbengine.myt#dbengine_supported
@@ -24,110 +27,193 @@ import time
 from random import sample
 from datetime import datetime
 
-from stuf.six import native
+from stuf.six import items
 try:
     from sqlalchemy import LargeBinary as Binary
 except ImportError:
     from sqlalchemy import Binary
 try:
     from sqlalchemy import (
-        MetaData, Table, Column, String, DateTime, select, update, insert,
-        delete,
+        MetaData, Table, Column, String, DateTime, select, bindparam, func,
     )
 except ImportError:
-    raise ImportError('requires SQLAlchemy >= 0.4')
+    raise ImportError('requires SQLAlchemy >= 1.2')
 
 from shove.base import Base
+from shove.stores.db import DBBase
 
 __all__ = ['DBCache']
 
 
-class DBCache(Base):
+class DBCache(DBBase, Base):
 
     '''Relational database-based cache frontend.'''
 
     def __init__(self, engine, **kw):
         super(DBCache, self).__init__(engine, **kw)
+        self._engine = self._connect(engine, **kw)
         # make cache table
-        self._store = Table(
+        self._store = cache = Table(
             # get table name
             kw.get('tablename', 'cache'),
-            # bind metadata
-            MetaData(engine),
+            MetaData(),
             Column('key', String(60), primary_key=True, nullable=False),
             Column('value', Binary, nullable=False),
             Column('expires', DateTime, nullable=False),
         )
         # create cache table if it does not exist
-        if not self._store.exists():
-            self._store.create()
+        cache.create(self._engine, checkfirst=True)
         # set maximum entries
         self._max_entries = kw.get('max_entries', 300)
         # maximum number of entries to cull per call if cache is full
         self._maxcull = kw.get('maxcull', 10)
         # set timeout
         self.timeout = kw.get('timeout', 300)
+        # statements for the hot paths are only built once
+        c = cache.c
+        self._select = select(
+            [c.value, c.expires], c.key == bindparam('_key'),
+        )
+        self._select_many = select(
+            [c.key, c.value, c.expires],
+            c.key.in_(bindparam('_keys', expanding=True)),
+        )
+        self._insert = cache.insert()
+        self._update = cache.update(c.key == bindparam('_key'))
+        self._delete = cache.delete(c.key == bindparam('_key'))
+        self._delete_many = cache.delete(
+            c.key.in_(bindparam('_keys', expanding=True))
+        )
+        self._expire = cache.delete(c.expires < bindparam('_now'))
+        self._count = select([func.count()]).select_from(cache)
+        self._upsert_stmt = self._upserter(cache)
+        self._keepzdicts(cache)
+        self._keys = select([c.key])
+        self._sample = select([c.key]).limit(bindparam('_limit'))
+        # running estimate of the number of entries (the table is only
+        # counted again when the estimate reaches the maximum)
+        self._length = len(self)
+
+    def __contains__(self, key):
+        with self._connection() as conn:
+            row = conn.execute(self._select, _key=key).fetchone()
+        return (
+            row is not None and
+            row.expires >= datetime.now().replace(microsecond=0)
+        )
 
     def __getitem__(self, key):
-        row = select(
-             [self._store.c.value, self._store.c.expires],
-            self._store.c.key == key
-        ).execute().fetchone()
+        with self._connection() as conn:
+            row = conn.execute(self._select, _key=key).fetchone()
         if row is not None:
             # remove if item expired
             if row.expires < datetime.now().replace(microsecond=0):
                 del self[key]
                 raise KeyError(key)
-            return self.loads(native(row.value))
+            return self.loads(row.value)
         raise KeyError(key)
 
     def __setitem__(self, key, value):
+        self.set(key, value)
+
+    def set(self, key, value, ttl=None):
+        '''
+        Stores an object that expires after `ttl` seconds.
+
+        :argument key: key
+        :argument value: object
+        :argument ttl: seconds the object is kept (default the timeout)
+        '''
         value = self.dumps(value)
         # cull if too many items
-        if len(self) >= self._max_entries:
+        if self._length >= self._max_entries:
             self._cull()
+        self._length += 1
         # generate expiration time
         expires = datetime.fromtimestamp(
-            time.time() + self.timeout
+            time.time() + (self.timeout if ttl is None else ttl)
         ).replace(microsecond=0)
-        # update database if key already present
-        if key in self:
-            cache = self._store
-            update(
-                cache,
-                cache.c.key == key,
-                dict(value=value, expires=expires),
-            ).execute()
-        # insert new key if key not present
-        else:
-            insert(
-                self._store, dict(key=key, value=value, expires=expires)
-            ).execute()
+        with self._connection(True) as conn:
+            self._upsert(conn, [dict(key=key, value=value, expires=expires)])
 
     def __delitem__(self, key):
-        self._store.delete(self._store.c.key == key).execute()
+        with self._connection(True) as conn:
+            if conn.execute(self._delete, _key=key).rowcount:
+                self._length -= 1
+
+    def get_many(self, keys):
+        keys = list(keys)
+        if not keys:
+            return dict()
+        loads = self.loads
+        now = datetime.now().replace(microsecond=0)
+        with self._connection() as conn:
+            rows = conn.execute(self._select_many, _keys=keys).fetchall()
+        found, expired = dict(), list()
+        for row in rows:
+            # collect items that timed out for removal
+            if row.expires < now:
+                expired.append(row.key)
+            else:
+                found[row.key] = loads(row.value)
+        if expired:
+            self.delete_many(expired)
+        return found
+
+    def set_many(self, mapping):
+        if not mapping:
+            return
+        dumps = self.dumps
+        # cull if too many items
+        if self._length + len(mapping) > self._max_entries:
+            self._cull()
+        self._length += len(mapping)
+        # generate expiration time
+        expires = datetime.fromtimestamp(
+            time.time() + self.timeout
+        ).replace(microsecond=0)
+        with self._connection(True) as conn:
+            self._upsert(conn, list(
+                dict(key=k, value=dumps(v), expires=expires)
+                for k, v in items(mapping)
+            ))
+
+    def delete_many(self, keys):
+        keys = list(keys)
+        if keys:
+            with self._connection(True) as conn:
+                self._length -= conn.execute(
+                    self._delete_many, _keys=keys,
+                ).rowcount
 
     def __iter__(self):
-        for item in select([self._store.c.key]).execute().fetchall():
+        with self._connection() as conn:
+            rows = conn.execute(self._keys).fetchall()
+        for item in rows:
             yield item[0]
 
     def __len__(self):
-        return self._store.count().execute().fetchone()[0]
+        with self._connection() as conn:
+            return conn.execute(self._count).scalar()
 
     def _cull(self):
         # remove items in cache to make more room
-        cache = self._store
-        # remove items that have timed out
-        delete(
-            cache, cache.c.expires < datetime.now().replace(microsecond=0),
-        ).execute()
-        # remove any items over the maximum allowed number in the cache
-        length = len(self)
-        if length >= self._max_entries:
-            cull = length if length < self._maxcull else self._maxcull
-            # get list of keys
-            keys = list(i[0] for i in select(
-                [cache.c.key], limit=cull * 2
-            ).execute().fetchall())
-            # delete keys at random
-            delete(cache, cache.c.key.in_(sample(keys, cull))).execute()
+        with self._connection(True) as conn:
+            # remove items that have timed out
+            conn.execute(
+                self._expire, _now=datetime.now().replace(microsecond=0),
+            )
+            # remove any items over the maximum allowed number in the cache
+            length = conn.execute(self._count).scalar()
+            if length >= self._max_entries:
+                cull = length if length < self._maxcull else self._maxcull
+                # get list of keys
+                keys = list(i[0] for i in conn.execute(
+                    self._sample, _limit=cull * 2,
+                ).fetchall())
+                # delete keys at random
+                length -= conn.execute(
+                    self._delete_many, _keys=sample(keys, cull),
+                ).rowcount
+        # the estimate restarts from the real count
+        self._length = length
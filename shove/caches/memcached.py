@@ -12,6 +12,8 @@ try:
 except ImportError:
     raise ImportError("requires 'python-memcached' library")
 
+from stuf.six import items
+
 from shove.base import Base
 
 __all__ = ['MemCache']
@@ -36,7 +38,34 @@ class MemCache(Base):
         return self.loads(value)
 
     def __setitem__(self, key, value):
-        self._store.set(key, self.dumps(value), self.timeout)
+        self.set(key, value)
+
+    def set(self, key, value, ttl=None):
+        '''
+        Stores an object that expires after `ttl` seconds.
+
+        :argument key: key
+        :argument value: object
+        :argument ttl: seconds the object is kept (default the timeout)
+        '''
+        self._store.set(
+            key, self.dumps(value), self.timeout if ttl is None else ttl,
+        )
 
     def __delitem__(self, key):
         self._store.delete(key)
+
+    def get_many(self, keys):
+        loads = self.loads
+        return dict(
+            (k, loads(v)) for k, v in items(self._store.get_multi(list(keys)))
+        )
+
+    def set_many(self, mapping):
+        dumps = self.dumps
+        self._store.set_multi(
+            dict((k, dumps(v)) for k, v in items(mapping)), self.timeout,
+        )
+
+    def delete_many(self, keys):
+        self._store.delete_multi(list(keys))
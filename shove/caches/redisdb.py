@@ -12,6 +12,8 @@ try:
 except ImportError:
     raise ImportError('requires redis')
 
+from stuf.six import items
+
 from shove.base import Base
 from shove._compat import urlsplit
 
@@ -32,12 +34,58 @@ class RedisCache(Base):
         self._store = redis.Redis(host, int(port), db)
         # Set timeout
         self.timeout = kw.get('timeout', 300)
+        # hash of trained compression dictionaries (the NUL keeps it out of
+        # the way of cached keys)
+        self._zdict = '\x00zdict'
+        self._zdicts.bind(self._readzdicts, self._writezdict)
 
     def __getitem__(self, key):
         return self.loads(self._store[key])
 
     def __setitem__(self, key, value):
-        self._store.setex(key, self.dumps(value), self.timeout)
+        self.set(key, value)
+
+    def set(self, key, value, ttl=None):
+        '''
+        Stores an object that expires after `ttl` seconds.
+
+        :argument key: key
+        :argument value: object
+        :argument ttl: seconds the object is kept (default the timeout)
+        '''
+        self._store.setex(
+            key, self.dumps(value), self.timeout if ttl is None else ttl,
+        )
 
     def __delitem__(self, key):
         self._store.delete(key)
+
+    def _readzdicts(self):
+        return self._store.hgetall(self._zdict)
+
+    def _writezdict(self, version, data):
+        return bool(self._store.hsetnx(self._zdict, version, data))
+
+    def get_many(self, keys):
+        keys = list(keys)
+        if not keys:
+            return dict()
+        loads = self.loads
+        # one MGET round trip for the whole batch
+        return dict(
+            (k, loads(v)) for k, v in zip(keys, self._store.mget(keys))
+            if v is not None
+        )
+
+    def set_many(self, mapping):
+        if mapping:
+            dumps, timeout = self.dumps, self.timeout
+            pipe = self._store.pipeline(transaction=False)
+            for key, value in items(mapping):
+                pipe.setex(key, dumps(value), timeout)
+            pipe.execute()
+
+    def delete_many(self, keys):
+        keys = list(keys)
+        if keys:
+            self._store.delete(*keys)
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+'''
+Shared-memory object cache.
+
+The shove URI for a shared-memory cache is:
+
+shm://<name>
+
+See :mod:`shove.stores.shm` for how processes share the file.
+'''
+
+from time import time
+from random import sample
+
+from stuf.six import items
+
+from shove.base import Base
+from shove._compat import synchronized
+from shove.stores.shm import LOCK_EX, LOCK_SH, ShmBase, _tobytes
+
+__all__ = ['ShmCache']
+
+
+class ShmCache(ShmBase, Base):
+
+    '''Shared-memory cache backend.'''
+
+    def __init__(self, engine, **kw):
+        super(ShmCache, self).__init__(engine, **kw)
+        # set maximum entries
+        self._max_entries = kw.get('max_entries', 300)
+        # maximum number of entries to cull per call if cache is full
+        self._maxcull = kw.get('maxcull', 10)
+        # set timeout
+        self.timeout = kw.get('timeout', 300)
+
+    @synchronized
+    def __contains__(self, key):
+        with self._flock(LOCK_SH):
+            try:
+                return self._get(key)[0] >= time()
+            except KeyError:
+                return False
+
+    def __getitem__(self, key):
+        with self._lock:
+            with self._flock(LOCK_SH):
+                expires, value = self._get(key)
+        # expired entries are removed when the cache is culled
+        if expires < time():
+            raise KeyError(key)
+        return self.loads(value)
+
+    def __setitem__(self, key, value):
+        self.set(key, value)
+
+    def set(self, key, value, ttl=None):
+        '''
+        Stores an object that expires after `ttl` seconds.
+
+        :argument key: key
+        :argument value: object
+        :argument ttl: seconds the object is kept (default the timeout)
+        '''
+        self._set({key: value}, ttl)
+
+    @synchronized
+    def __delitem__(self, key):
+        with self._flock(LOCK_EX):
+            self._remove([key])
+
+    def get_many(self, keys):
+        found, now = dict(), time()
+        with self._lock:
+            with self._flock(LOCK_SH):
+                for key in keys:
+                    try:
+                        expires, value = self._get(key)
+                    except KeyError:
+                        continue
+                    if expires >= now:
+                        found[key] = value
+        loads = self.loads
+        return dict((k, loads(v)) for k, v in items(found))
+
+    def set_many(self, mapping):
+        self._set(mapping, None)
+
+    @synchronized
+    def delete_many(self, keys):
+        with self._flock(LOCK_EX):
+            self._remove(keys)
+
+    def _set(self, mapping, ttl):
+        # stores objects that expire after `ttl` seconds
+        dumps = self.dumps
+        values = list((k, dumps(v)) for k, v in items(mapping))
+        with self._lock:
+            with self._flock(LOCK_EX):
+                expires = time() + (self.timeout if ttl is None else ttl)
+                for key, value in values:
+                    if self._count() >= self._max_entries:
+                        if self._find(_tobytes(key))[0] is None:
+                            self._cull()
+                    self._put(key, expires, value)
+
+    def _cull(self):
+        # removes expired entries, then random ones if still at the maximum
+        now, live = time(), list()
+        for at, _, expires in self._scan():
+            if expires < now:
+                self._delete(at)
+            else:
+                live.append(at)
+        excess = len(live) - self._max_entries + 1
+        if excess > 0:
+            for at in sample(live, min(len(live), max(excess, self._maxcull))):
+                self._delete(at)
@@ -1,18 +1,225 @@
 # -*- coding: utf-8 -*-
 '''shove core.'''
 
-from functools import partial
+from sys import getsizeof
 from operator import methodcaller
+from threading import Condition, Event, Lock, Thread
 from collections import MutableMapping
 
+from stuf.six import values
 from stuf.iterable import exhaustcall
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ThreadPoolExecutor, wait
 
+from shove._compat import clock
 from shove._imports import cache_backend, store_backend
 
 __all__ = ('Shove', 'MultiShove')
 
 
+class Flusher(object):
+
+    '''
+    Write-behind buffer drained to the store(s) by a background thread once
+    `count` objects or about `size` bytes (shallow sizes) are buffered or
+    the oldest buffered object is `interval` seconds old. Writers wait while
+    `limit` objects are buffered.
+    '''
+
+    def __init__(self, write, count=2, size=None, interval=1.0, limit=1024):
+        self._write = write
+        self._count = count
+        self._size = size
+        self._interval = interval
+        self._limit = max(limit, count)
+        self._lock = Condition()
+        # objects waiting to be written and the batch being written
+        self._buffer = dict()
+        self._batch = dict()
+        self._bytes = 0
+        # when the oldest buffered object was buffered
+        self._since = None
+        # number of callers waiting for the buffer to drain
+        self._drains = 0
+        # error raised by the last write (raised again in the next caller)
+        self._error = None
+        self._closed = False
+        self._thread = Thread(target=self._run, name='shove-flusher')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._buffer) + len(self._batch)
+
+    def get_many(self, keys):
+        '''
+        Returns a :class:`dict` of the pending objects for `keys`.
+
+        :argument keys: iterable of keys
+        '''
+        with self._lock:
+            found = dict()
+            for key in keys:
+                for pending in (self._buffer, self._batch):
+                    if key in pending:
+                        found[key] = pending[key]
+                        break
+            return found
+
+    def put(self, mapping):
+        '''
+        Buffers several objects, waiting while the buffer is full.
+
+        :argument mapping: mapping of keys to objects
+        '''
+        lock = self._lock
+        with lock:
+            self._raise()
+            while len(self._buffer) >= self._limit:
+                lock.notify_all()
+                lock.wait()
+                self._raise()
+            first = not self._buffer
+            if first:
+                self._since = clock()
+            self._buffer.update(mapping)
+            if self._size is not None:
+                self._bytes += sum(getsizeof(i) for i in values(mapping))
+            # the thread starts timing the interval at the first object
+            if first or self._due():
+                lock.notify_all()
+
+    def drain(self):
+        '''Waits until every buffered object has been written.'''
+        lock = self._lock
+        with lock:
+            self._drains += 1
+            lock.notify_all()
+            try:
+                while (self._buffer or self._batch) and self._error is None:
+                    lock.wait()
+            finally:
+                self._drains -= 1
+            self._raise()
+
+    def close(self):
+        '''Drains the buffer and stops the background thread.'''
+        with self._lock:
+            self._closed = True
+            self._lock.notify_all()
+        self._thread.join()
+        with self._lock:
+            self._raise()
+
+    def _due(self):
+        # tells if enough objects or bytes are buffered to write them
+        return len(self._buffer) >= self._count or (
+            self._size is not None and self._bytes >= self._size
+        )
+
+    def _raise(self):
+        error, self._error = self._error, None
+        if error is not None:
+            raise error
+
+    def _ready(self):
+        # tells if the thread should write the buffer now
+        if self._error is not None or not self._buffer:
+            return False
+        if self._due() or self._drains or self._closed:
+            return True
+        interval = self._interval
+        return interval is not None and clock() - self._since >= interval
+
+    def _run(self):
+        lock = self._lock
+        while True:
+            with lock:
+                while not self._ready():
+                    if self._closed and (
+                        self._error is not None or not self._buffer
+                    ):
+                        return
+                    timeout = None
+                    if self._buffer and self._interval is not None:
+                        timeout = max(
+                            self._since + self._interval - clock(), 0,
+                        )
+                    lock.wait(timeout)
+                self._batch = batch = self._buffer
+                self._buffer, self._bytes = dict(), 0
+                # wake writers waiting for room in the buffer
+                lock.notify_all()
+            try:
+                self._write(batch)
+            except Exception as exc:
+                with lock:
+                    # objects buffered since keep their newer values
+                    for key, value in batch.items():
+                        self._buffer.setdefault(key, value)
+                    if self._buffer:
+                        self._since = clock()
+                    self._error = exc
+            finally:
+                with lock:
+                    self._batch = dict()
+                    lock.notify_all()
+
+
+class SingleFlight(object):
+
+    '''
+    Runs one call per key at a time. Callers asking for a key that is
+    already being loaded wait for that call and share its result.
+    '''
+
+    def __init__(self):
+        self._lock = Lock()
+        # key -> [done event, result, error] for calls in progress
+        self._calls = dict()
+
+    def __call__(self, key, call, *args):
+        with self._lock:
+            flight = self._calls.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._calls[key] = [Event(), None, None]
+        if leader:
+            try:
+                flight[1] = call(*args)
+            except Exception as exc:
+                flight[2] = exc
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                flight[0].set()
+        else:
+            flight[0].wait()
+        if flight[2] is not None:
+            raise flight[2]
+        return flight[1]
+
+
+def _flusher(write, kw):
+    # a background flusher if asked for with keyword background
+    if not kw.get('background', False):
+        return None
+    return Flusher(
+        write,
+        kw.get('sync', 2),
+        kw.get('sync_bytes'),
+        kw.get('sync_interval', 1.0),
+        kw.get('sync_limit', 1024),
+    )
+
+
+def _pending(buffer, flusher, keys):
+    # objects for keys that are buffered but not yet written
+    if flusher is not None:
+        return flusher.get_many(keys)
+    return dict((key, buffer[key]) for key in keys if key in buffer)
+
+
 class Shove(MutableMapping):
 
     '''Common object frontend class.'''
@@ -21,24 +228,49 @@ class Shove(MutableMapping):
         super(Shove, self).__init__()
         # load store backend
         self._store = store_backend(store, **kw)
-        # load cache backend
+        # load cache backend (a list of caches makes a tiered cache)
         self._cache = cache_backend(cache, **kw)
         # buffer for lazier writing
         self._buffer = dict()
         # setting for syncing frequency
         self._sync = kw.get('sync', 2)
+        # keyword background: write the buffer from a background thread
+        # (tuned with keywords sync_bytes, sync_interval, and sync_limit)
+        self._flusher = _flusher(self._write, kw)
+        # concurrent misses for a key share one store read
+        self._loader = SingleFlight()
 
     def __getitem__(self, key):
         try:
             return self._cache[key]
         except KeyError:
-            # synchronize cache with store
-            self.sync()
-            self._cache[key] = value = self._store[key]
-            return value
+            # a buffered object is served without writing the buffer
+            pending = _pending(self._buffer, self._flusher, (key,))
+            if pending:
+                self._cache[key] = value = pending[key]
+                return value
+            return self._loader(key, self._load, key)
 
     def __setitem__(self, key, value):
-        self._cache[key] = self._buffer[key] = value
+        self.set(key, value)
+
+    def set(self, key, value, ttl=None):
+        '''
+        Stores an object whose cached copy expires after `ttl` seconds.
+
+        :argument key: key
+        :argument value: object
+        :argument ttl: seconds the cache keeps the object (default the
+            cache's timeout; the store keeps it until it is deleted)
+        '''
+        if ttl is None:
+            self._cache[key] = value
+        else:
+            self._cache.set(key, value, ttl)
+        if self._flusher is not None:
+            self._flusher.put({key: value})
+            return
+        self._buffer[key] = value
         # when buffer reaches self._limit, write buffer to store
         if len(self._buffer) >= self._sync:
             self.sync()
@@ -58,6 +290,55 @@ class Shove(MutableMapping):
         self.sync()
         return self._store.__iter__()
 
+    def get_many(self, keys):
+        '''
+        Fetches several objects at once.
+
+        Keys missing from the cache are served from the write buffer or
+        fetched from the store in one batch. Returns a :class:`dict` of the keys that were found.
+
+        :argument keys: iterable of keys
+        '''
+        keys = list(keys)
+        found = self._cache.get_many(keys)
+        misses = [key for key in keys if key not in found]
+        if misses:
+            # buffered objects are served without writing the buffer
+            fetched = _pending(self._buffer, self._flusher, misses)
+            misses = [key for key in misses if key not in fetched]
+            if misses:
+                fetched.update(self._store.get_many(misses))
+            if fetched:
+                self._cache.set_many(fetched)
+                found.update(fetched)
+        return found
+
+    def set_many(self, mapping):
+        '''
+        Stores several objects at once.
+
+        :argument mapping: mapping of keys to objects
+        '''
+        self._cache.set_many(mapping)
+        if self._flusher is not None:
+            self._flusher.put(mapping)
+            return
+        self._buffer.update(mapping)
+        # when buffer reaches self._limit, write buffer to store
+        if len(self._buffer) >= self._sync:
+            self.sync()
+
+    def delete_many(self, keys):
+        '''
+        Removes several objects at once. Missing keys are skipped.
+
+        :argument keys: iterable of keys
+        '''
+        keys = list(keys)
+        self.sync()
+        self._cache.delete_many(keys)
+        self._store.delete_many(keys)
+
     def close(self):
         '''Finalizes and closes shove.'''
         # if close has been called, pass
@@ -66,13 +347,27 @@ class Shove(MutableMapping):
                 self.sync()
             except AttributeError:
                 pass
+            if self._flusher is not None:
+                self._flusher.close()
             self._store.close()
-        self._store = self._cache = self._buffer = None
+        self._store = self._cache = self._buffer = self._flusher = None
 
     def sync(self):
         '''Writes buffer to store.'''
-        self._store.update(self._buffer)
-        self._buffer.clear()
+        if self._flusher is not None:
+            self._flusher.drain()
+        elif self._buffer:
+            self._write(self._buffer)
+            self._buffer.clear()
+
+    def _load(self, key):
+        # reads a missed key from the store into the cache
+        self._cache[key] = value = self._store[key]
+        return value
+
+    def _write(self, batch):
+        # writes a batch of buffered objects to the store
+        self._store.set_many(batch)
 
 
 class MultiShove(MutableMapping):
@@ -92,19 +387,42 @@ class MultiShove(MutableMapping):
         self._buffer = dict()
         # setting for syncing frequency
         self._sync = kw.get('sync', 2)
+        # keyword background: write the buffer from a background thread
+        self._flusher = _flusher(self._write, kw)
+        # concurrent misses for a key share one store read
+        self._loader = SingleFlight()
 
     def __getitem__(self, key):
         try:
             return self._cache[key]
         except KeyError:
-            # synchronize cache and store
-            self.sync()
-            # get value from first store
-            self._cache[key] = value = self._stores[0][key]
-            return value
+            # a buffered object is served without writing the buffer
+            pending = _pending(self._buffer, self._flusher, (key,))
+            if pending:
+                self._cache[key] = value = pending[key]
+                return value
+            return self._loader(key, self._load, key)
 
     def __setitem__(self, key, value):
-        self._cache[key] = self._buffer[key] = value
+        self.set(key, value)
+
+    def set(self, key, value, ttl=None):
+        '''
+        Stores an object whose cached copy expires after `ttl` seconds.
+
+        :argument key: key
+        :argument value: object
+        :argument ttl: seconds the cache keeps the object (default the
+            cache's timeout; the stores keep it until it is deleted)
+        '''
+        if ttl is None:
+            self._cache[key] = value
+        else:
+            self._cache.set(key, value, ttl)
+        if self._flusher is not None:
+            self._flusher.put({key: value})
+            return
+        self._buffer[key] = value
         # when the buffer reaches self._limit, writes the buffer to the store
         if len(self._buffer) >= self._sync:
             self.sync()
@@ -127,22 +445,86 @@ class MultiShove(MutableMapping):
         self.sync()
         return self._stores[0].__iter__()
 
+    def get_many(self, keys):
+        '''
+        Fetches several objects at once.
+
+        Keys missing from the cache are served from the write buffer or
+        fetched from the first store in one batch. Returns a :class:`dict` of the keys that were found.
+
+        :argument keys: iterable of keys
+        '''
+        keys = list(keys)
+        found = self._cache.get_many(keys)
+        misses = [key for key in keys if key not in found]
+        if misses:
+            # buffered objects are served without writing the buffer
+            fetched = _pending(self._buffer, self._flusher, misses)
+            misses = [key for key in misses if key not in fetched]
+            if misses:
+                # get values from first store
+                fetched.update(self._stores[0].get_many(misses))
+            if fetched:
+                self._cache.set_many(fetched)
+                found.update(fetched)
+        return found
+
+    def set_many(self, mapping):
+        '''
+        Stores several objects at once.
+
+        :argument mapping: mapping of keys to objects
+        '''
+        self._cache.set_many(mapping)
+        if self._flusher is not None:
+            self._flusher.put(mapping)
+            return
+        self._buffer.update(mapping)
+        # when the buffer reaches self._limit, writes the buffer to the store
+        if len(self._buffer) >= self._sync:
+            self.sync()
+
+    def delete_many(self, keys):
+        '''
+        Removes several objects at once. Missing keys are skipped.
+
+        :argument keys: iterable of keys
+        '''
+        keys = list(keys)
+        self.sync()
+        exhaustcall(methodcaller('delete_many', keys), self._stores)
+        self._cache.delete_many(keys)
+
     def close(self):
         '''Finalizes and closes shove stores.'''
         # if close has been called, pass
         stores = self._stores
         if self._stores is not None:
             self.sync()
+            if self._flusher is not None:
+                self._flusher.close()
             # close stores
             for idx, store in enumerate(stores):
                 store.close()
                 stores[idx] = None
-        self._cache = self._buffer = self._stores = None
+        self._cache = self._buffer = self._stores = self._flusher = None
 
     def sync(self):
         '''Writes buffer to stores.'''
-        exhaustcall(methodcaller('update', self._buffer), self._stores)
-        self._buffer.clear()
+        if self._flusher is not None:
+            self._flusher.drain()
+        elif self._buffer:
+            self._write(self._buffer)
+            self._buffer.clear()
+
+    def _load(self, key):
+        # reads a missed key from the first store into the cache
+        self._cache[key] = value = self._stores[0][key]
+        return value
+
+    def _write(self, batch):
+        # writes a batch of buffered objects to every store
+        exhaustcall(methodcaller('set_many', batch), self._stores)
 
 
 class ThreadShove(MultiShove):
@@ -153,27 +535,57 @@ class ThreadShove(MultiShove):
         # init superclass with first store
         super(ThreadShove, self).__init__(*stores, **kw)
         self._maxworkers = kw.get('max_workers', 2)
+        # keyword queues: one worker per store so a slow store only holds up
+        # its own queue (otherwise stores share a pool of max_workers)
+        if kw.get('queues', False):
+            self._executors = list(
+                ThreadPoolExecutor(max_workers=1) for _ in self._stores
+            )
+        else:
+            executor = ThreadPoolExecutor(max_workers=self._maxworkers)
+            self._executors = [executor] * len(self._stores)
 
     def __delitem__(self, key):
         try:
             self.sync()
         except AttributeError:
             pass
-        with ThreadPoolExecutor(max_workers=self._maxworkers) as executor:
-            method = partial(
-                executor.submit, methodcaller('__delitem__', key)
-            )
-            exhaustcall(method, self._stores)
+        self._each(methodcaller('__delitem__', key))
         try:
             del self._cache[key]
         except KeyError:
             pass
 
-    def sync(self):
-        '''Writes buffer to store.'''
-        with ThreadPoolExecutor(max_workers=self._maxworkers) as executor:
-            method = partial(
-                executor.submit, methodcaller('update', self._buffer),
-            )
-            exhaustcall(method, self._stores)
-        self._buffer.clear()
+    def delete_many(self, keys):
+        '''
+        Removes several objects at once. Missing keys are skipped.
+
+        :argument keys: iterable of keys
+        '''
+        keys = list(keys)
+        self.sync()
+        self._each(methodcaller('delete_many', keys))
+        self._cache.delete_many(keys)
+
+    def close(self):
+        '''Finalizes and closes shove stores and their workers.'''
+        try:
+            super(ThreadShove, self).close()
+        finally:
+            if self._executors is not None:
+                for executor in set(self._executors):
+                    executor.shutdown()
+                self._executors = None
+
+    def _each(self, call):
+        # runs a call on every store concurrently and waits for all of them
+        futures = list(
+            executor.submit(call, store)
+            for executor, store in zip(self._executors, self._stores)
+        )
+        wait(futures)
+        exhaustcall(methodcaller('result'), futures)
+
+    def _write(self, batch):
+        # writes a batch of buffered objects to every store concurrently
+        self._each(methodcaller('set_many', batch))
@@ -0,0 +1,655 @@
+# -*- coding: utf-8 -*-
+'''
+shove serializers and codecs.
+
+Values written by :meth:`shove.base.Base.dumps` start with one header byte
+naming the serializer and codec that produced them. Header bytes start at
+0xA0, above the first byte of any pickle or zlib stream, so values stored
+before headers were added are still recognized and loaded.
+'''
+
+import bz2
+import json
+import zlib
+import marshal
+import pickletools
+from struct import Struct
+from os import listdir, makedirs
+from os.path import exists, join
+
+from stuf.six import PY3, HIGHEST_PROTOCOL, dumps
+
+from shove._compat import clock, memoryview, pickle, replace
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+__all__ = (
+    'Codec', 'Dictionaries', 'Serializer', 'Timed', 'codecs', 'header',
+    'register', 'serializers', 'train',
+)
+
+# first header byte (headers are HEADER + serializer * 8 + codec)
+HEADER = 0xA0
+
+# serializers and codecs by name and by header id
+serializers = dict()
+codecs = dict()
+_serializers = dict()
+_codecs = dict()
+
+
+def register(cls):
+    '''
+    Registers a :class:`Serializer` or :class:`Codec` class.
+
+    :argument cls: class with `name` and `ident` attributes
+    '''
+    if issubclass(cls, Serializer):
+        if not 0 <= cls.ident < 12:
+            raise ValueError('serializer ids run from 0 to 11')
+        serializers[cls.name] = _serializers[cls.ident] = cls
+    else:
+        if not 0 <= cls.ident < 8:
+            raise ValueError('codec ids run from 0 to 7')
+        codecs[cls.name] = _codecs[cls.ident] = cls
+    return cls
+
+
+def header(value):
+    '''
+    Splits a stored value into its serializer class, codec class, and body.
+    Returns :const:`None` for values without a header.
+
+    :argument value: bytes, buffer, or :class:`memoryview`
+    '''
+    # Python 2 views would slice into views whose bytes() is their repr
+    if not PY3 and isinstance(value, memoryview):
+        value = value.tobytes()
+    first = bytearray(value[:1])
+    if not first:
+        return None
+    ident = first[0] - HEADER
+    if ident < 0:
+        return None
+    try:
+        serializer = _serializers[ident // 8]
+        codec = _codecs[ident % 8]
+    except KeyError:
+        raise ValueError('unknown value header {0}'.format(ident + HEADER))
+    # slice views so the body isn't copied
+    body = memoryview(value)[1:] if PY3 else value[1:]
+    return serializer, codec, body
+
+
+def train(samples, size=32768, width=8):
+    '''
+    Builds a compression dictionary from serialized sample values. Samples
+    sharing the most substrings with other samples are kept, the most
+    typical last where zlib reaches them with the shortest distances.
+
+    :argument samples: iterable of bytes
+    :keyword size: maximum dictionary size in bytes
+    :keyword width: substring length used to compare samples
+    '''
+    samples = list(set(bytes(i) for i in samples))
+    shingles = [
+        set(sample[i:i + width] for i in range(len(sample) - width + 1))
+        for sample in samples
+    ]
+    # how many samples share each substring
+    counts = dict()
+    for shingle in shingles:
+        for part in shingle:
+            counts[part] = counts.get(part, 0) + 1
+    scored = sorted(
+        (sum(counts[i] for i in shingle) / float(len(sample) or 1), sample)
+        for sample, shingle in zip(samples, shingles)
+    )
+    chosen = []
+    total = 0
+    for _, sample in reversed(scored):
+        if total + len(sample) > size:
+            continue
+        chosen.append(sample)
+        total += len(sample)
+    return b''.join(reversed(chosen))
+
+
+class Dictionaries(object):
+
+    '''
+    Versioned compression dictionaries so values compressed with an older
+    version stay readable. Dictionaries are kept as files in a directory or,
+    without one, by the store itself (see :meth:`bind`).
+    '''
+
+    def __init__(self, path=None):
+        self.path = path
+        self._versions = None
+        # callables reading and saving dictionaries in a store
+        self._reader = self._writer = None
+
+    def __getitem__(self, version):
+        versions = self._load()
+        if version not in versions:
+            # another process may have trained a newer dictionary
+            versions = self._load(True)
+        try:
+            return versions[version]
+        except KeyError:
+            raise ValueError(
+                'unknown compression dictionary {0}'.format(version)
+            )
+
+    def add(self, data):
+        '''
+        Saves dictionary `data` as the newest version and returns its number.
+
+        :argument data: dictionary bytes
+        '''
+        if self.path is None and self._writer is None:
+            raise ValueError(
+                'this store cannot keep compression dictionaries so pass a '
+                'zdict directory'
+            )
+        while True:
+            versions = self._load(True)
+            version = max(versions) + 1 if versions else 1
+            # a writer refuses a version another process saved first
+            if self._save(version, data):
+                versions[version] = data
+                return version
+
+    def bind(self, reader, writer):
+        '''
+        Keeps dictionaries in a store unless a directory was given.
+
+        :argument reader: callable returning a :class:`dict` of version
+            numbers to dictionary bytes
+        :argument writer: callable saving dictionary bytes under a new
+            version number, returning False if that version exists
+        '''
+        if self.path is None:
+            self._reader, self._writer = reader, writer
+            self._versions = None
+
+    def latest(self):
+        '''Returns the newest version number and dictionary or (0, None).'''
+        versions = self._load()
+        if not versions:
+            return 0, None
+        version = max(versions)
+        return version, versions[version]
+
+    def _load(self, reload=False):
+        if self._versions is None or reload:
+            versions = dict()
+            if self.path is not None:
+                if exists(self.path):
+                    for name in listdir(self.path):
+                        if name.isdigit():
+                            with open(join(self.path, name), 'rb') as item:
+                                versions[int(name)] = item.read()
+            elif self._reader is not None:
+                versions.update(
+                    (int(k), bytes(v)) for k, v in self._reader().items()
+                )
+            self._versions = versions
+        return self._versions
+
+    def _save(self, version, data):
+        if self.path is None:
+            return self._writer(version, data)
+        if not exists(self.path):
+            makedirs(self.path)
+        path = join(self.path, str(version))
+        with open(path + '.tmp', 'wb') as item:
+            item.write(data)
+        replace(path + '.tmp', path)
+        return True
+
+
+def record(timings, phase, seconds):
+    '''
+    Adds one call taking `seconds` to `phase` in `timings`.
+
+    :argument timings: :class:`dict` of phase to [calls, seconds]
+    :argument phase: phase name
+    :argument seconds: time spent
+    '''
+    try:
+        entry = timings[phase]
+    except KeyError:
+        entry = timings[phase] = [0, 0.0]
+    entry[0] += 1
+    entry[1] += seconds
+
+
+class Timed(object):
+
+    '''Records calls to and time spent in a serializer or codec.'''
+
+    def __init__(self, wrapped, timings):
+        self.ident = wrapped.ident
+        self.name = wrapped.name
+        self._wrapped = wrapped
+        self._timings = timings
+
+    def _time(self, phase, method, data):
+        start = clock()
+        try:
+            return method(data)
+        finally:
+            record(self._timings, phase, clock() - start)
+
+    def dumps(self, value):
+        return self._time('serialize', self._wrapped.dumps, value)
+
+    def loads(self, data):
+        return self._time('deserialize', self._wrapped.loads, data)
+
+    def compress(self, data):
+        return self._time('compress', self._wrapped.compress, data)
+
+    def decompress(self, data):
+        return self._time('decompress', self._wrapped.decompress, data)
+
+
+def _text(data):
+    return bytes(data).decode('utf-8')
+
+
+class Serializer(object):
+
+    '''Base serializer.'''
+
+    # header id (0-11) and registered name
+    ident = None
+    name = None
+
+    def __init__(self, **kw):
+        pass
+
+    def dumps(self, value):
+        '''Serializes object `value` to bytes.'''
+        raise NotImplementedError
+
+    def loads(self, data):
+        '''Deserializes bytes or a :class:`memoryview` `data`.'''
+        raise NotImplementedError
+
+
+@register
+class Pickle(Serializer):
+
+    '''Pickle with a selectable protocol, optionally pickletools optimized.'''
+
+    ident = 0
+    name = 'pickle'
+
+    def __init__(self, **kw):
+        self.protocol = kw.get('protocol', HIGHEST_PROTOCOL)
+        # keyword optimize: True, False, or 'auto' to only optimize pickles
+        # up to optimize_max bytes from protocols before framing (4)
+        self.optimize = kw.get('optimize', 'auto')
+        self.optimize_max = kw.get('optimize_max', 65536)
+        # phase timings shared with the owning store (if enabled)
+        self.timings = None
+
+    def dumps(self, value):
+        value = dumps(value, self.protocol)
+        optimize = self.optimize
+        if optimize is True or (
+            optimize and self.protocol < 4 and len(value) <= self.optimize_max
+        ):
+            if self.timings is None:
+                return pickletools.optimize(value)
+            start = clock()
+            value = pickletools.optimize(value)
+            record(self.timings, 'optimize', clock() - start)
+        return value
+
+    def loads(self, data):
+        if PY3:
+            return pickle.loads(data, encoding='latin-1')
+        return pickle.loads(data)
+
+
+# out-of-band buffer count and buffer sizes in front of protocol 5 pickles
+COUNT = Struct('>I')
+SIZE = Struct('>Q')
+
+if pickle.HIGHEST_PROTOCOL >= 5:
+    @register
+    class PickleBuffers(Serializer):
+
+        '''
+        Pickle protocol 5 keeping buffers of at least `oob_min` bytes out of
+        band as separate segments that load as views without copies.
+        '''
+
+        ident = 7
+        name = 'pickle5'
+
+        def __init__(self, **kw):
+            self.oob_min = kw.get('oob_min', 65536)
+
+        def dumps(self, value):
+            # the pickle follows a count and the sizes of the buffers, which
+            # follow it as separate segments
+            buffers = []
+            oob_min = self.oob_min
+
+            def callback(buffer):
+                view = buffer.raw()
+                if view.nbytes < oob_min:
+                    return True
+                buffers.append(view)
+
+            data = pickle.dumps(value, 5, buffer_callback=callback)
+            sizes = COUNT.pack(len(buffers)) + b''.join(
+                SIZE.pack(buffer.nbytes) for buffer in buffers
+            )
+            if not buffers:
+                return sizes + data
+            return [sizes, data] + buffers
+
+        def loads(self, data):
+            if not isinstance(data, memoryview):
+                data = memoryview(data)
+            count = COUNT.unpack_from(data)[0]
+            start = COUNT.size + count * SIZE.size
+            sizes = [
+                SIZE.unpack_from(data, COUNT.size + i * SIZE.size)[0]
+                for i in range(count)
+            ]
+            offset = len(data) - sum(sizes)
+            end, buffers = offset, []
+            for size in sizes:
+                buffers.append(data[offset:offset + size])
+                offset += size
+            return pickle.loads(data[start:end], buffers=buffers)
+
+
+@register
+class Marshal(Serializer):
+
+    '''Marshal for builtin types.'''
+
+    ident = 1
+    name = 'marshal'
+
+    def dumps(self, value):
+        return marshal.dumps(value)
+
+    def loads(self, data):
+        return marshal.loads(data if PY3 else bytes(data))
+
+
+@register
+class JSON(Serializer):
+
+    '''UTF-8 encoded JSON.'''
+
+    ident = 2
+    name = 'json'
+
+    def dumps(self, value):
+        return json.dumps(value, separators=(',', ':')).encode('utf-8')
+
+    def loads(self, data):
+        return json.loads(_text(data))
+
+
+if msgpack is not None:
+    @register
+    class MsgPack(Serializer):
+
+        '''MessagePack (needs the msgpack library).'''
+
+        ident = 3
+        name = 'msgpack'
+
+        def dumps(self, value):
+            return msgpack.packb(value, use_bin_type=True)
+
+        def loads(self, data):
+            return msgpack.unpackb(data, raw=False)
+
+
+@register
+class Raw(Serializer):
+
+    '''Passes bytes through as they are.'''
+
+    ident = 4
+    name = 'bytes'
+
+    def dumps(self, value):
+        if not isinstance(value, bytes):
+            raise TypeError('bytes serializer needs bytes values')
+        return value
+
+    def loads(self, data):
+        return bytes(data)
+
+
+@register
+class Text(Serializer):
+
+    '''Stores text as UTF-8.'''
+
+    ident = 5
+    name = 'str'
+
+    def dumps(self, value):
+        return value.encode('utf-8')
+
+    def loads(self, data):
+        return _text(data)
+
+
+@register
+class Int(Serializer):
+
+    '''Stores integers as ASCII decimal digits.'''
+
+    ident = 6
+    name = 'int'
+
+    def dumps(self, value):
+        return str(value).encode('ascii')
+
+    def loads(self, data):
+        return int(bytes(data))
+
+
+# serializers for values stored natively instead of pickled, by exact type
+# (so bool and other subclasses keep their type through pickle)
+fastpaths = {bytes: Raw, type(u''): Text, int: Int}
+
+
+class Codec(object):
+
+    '''Base codec.'''
+
+    # header id (0-7) and registered name
+    ident = None
+    name = None
+
+    def __init__(self, level=None, **kw):
+        self.level = level
+
+    def compress(self, data):
+        '''Compresses bytes `data`.'''
+        return data
+
+    def decompress(self, data):
+        '''Decompresses bytes or a :class:`memoryview` `data`.'''
+        return data
+
+
+@register
+class Identity(Codec):
+
+    '''Stores data uncompressed.'''
+
+    ident = 0
+    name = 'none'
+
+
+@register
+class Zlib(Codec):
+
+    '''zlib compression (level 1-9, default 6).'''
+
+    ident = 1
+    name = 'zlib'
+
+    def compress(self, data):
+        return zlib.compress(data, 6 if self.level is None else self.level)
+
+    def decompress(self, data):
+        return zlib.decompress(data)
+
+
+@register
+class BZ2(Codec):
+
+    '''bzip2 compression (level 1-9, default 9).'''
+
+    ident = 2
+    name = 'bz2'
+
+    def compress(self, data):
+        return bz2.compress(data, 9 if self.level is None else self.level)
+
+    def decompress(self, data):
+        return bz2.decompress(data)
+
+
+if lzma is not None:
+    @register
+    class LZMA(Codec):
+
+        '''LZMA compression (preset 0-9, default 6).'''
+
+        ident = 3
+        name = 'lzma'
+
+        def compress(self, data):
+            return lzma.compress(
+                data, preset=6 if self.level is None else self.level,
+            )
+
+        def decompress(self, data):
+            return lzma.decompress(data)
+
+
+if lz4 is not None:
+    @register
+    class LZ4(Codec):
+
+        '''LZ4 frame compression (needs the lz4 library).'''
+
+        ident = 4
+        name = 'lz4'
+
+        def compress(self, data):
+            return lz4.frame.compress(
+                data, compression_level=self.level or 0,
+            )
+
+        def decompress(self, data):
+            return lz4.frame.decompress(data)
+
+
+if zstandard is not None:
+    @register
+    class Zstd(Codec):
+
+        '''Zstandard compression (needs the zstandard library).'''
+
+        ident = 5
+        name = 'zstd'
+
+        def __init__(self, level=None, **kw):
+            super(Zstd, self).__init__(level)
+            self._compressor = zstandard.ZstdCompressor(
+                level=3 if level is None else level,
+            )
+            self._decompressor = zstandard.ZstdDecompressor()
+
+        def compress(self, data):
+            return self._compressor.compress(data)
+
+        def decompress(self, data):
+            return self._decompressor.decompress(data)
+
+
+# dictionary version in front of zdict compressed data
+VERSION = Struct('>H')
+
+
+try:
+    zlib.compressobj(zdict=b'shove')
+except TypeError:
+    pass
+else:
+    @register
+    class ZDict(Codec):
+
+        '''
+        zlib compression primed with the newest trained dictionary (see
+        :meth:`shove.base.Base.train`).
+        '''
+
+        ident = 6
+        name = 'zdict'
+
+        def __init__(self, level=None, **kw):
+            super(ZDict, self).__init__(level)
+            self._dictionaries = kw.get('zdicts') or Dictionaries()
+
+        def compress(self, data):
+            version, zdict = self._dictionaries.latest()
+            level = 6 if self.level is None else self.level
+            if zdict is None:
+                compressor = zlib.compressobj(level)
+            else:
+                compressor = zlib.compressobj(level, zdict=zdict)
+            return b''.join([
+                VERSION.pack(version), compressor.compress(data),
+                compressor.flush(),
+            ])
+
+        def decompress(self, data):
+            version = VERSION.unpack(bytes(data[:VERSION.size]))[0]
+            if version:
+                decompressor = zlib.decompressobj(
+                    zdict=self._dictionaries[version],
+                )
+            else:
+                decompressor = zlib.decompressobj()
+            return b''.join([
+                decompressor.decompress(data[VERSION.size:]),
+                decompressor.flush(),
+            ])
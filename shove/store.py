@@ -2,12 +2,14 @@
 '''shove store support.'''
 
 import shutil
-from copy import deepcopy
-from threading import Condition
+from os import listdir, remove
+from os.path import isdir, join
 from collections import MutableMapping
 
-from shove.base import Mapping, FileBase
-from shove._compat import anydbm, synchronized, url2pathname
+from stuf.six import items
+
+from shove.base import Isolated, Mapping, FileBase
+from shove._compat import RWLock, anydbm, shared, synchronized, url2pathname
 
 __all__ = ('DBMStore', 'FileStore', 'MemoryStore', 'SimpleStore')
 
@@ -40,7 +42,7 @@ class SimpleStore(BaseStore):
         self._store = dict()
 
 
-class MemoryStore(SimpleStore):
+class MemoryStore(Isolated, SimpleStore):
 
     '''
     Thread-safe in-memory store.
@@ -48,18 +50,37 @@ class MemoryStore(SimpleStore):
     The shove URI for a memory store is:
 
     memory://
+
+    See :class:`shove.base.Isolated` for the `isolation` keyword.
     '''
 
     def __init__(self, engine, **kw):
         super(MemoryStore, self).__init__(engine, **kw)
-        self._lock = Condition()
+        # readers share the lock so they only wait for writers
+        self._lock = RWLock()
 
-    @synchronized
+    @shared
     def __getitem__(self, key):
-        return deepcopy(super(MemoryStore, self).__getitem__(key))
+        return self._unpack(super(MemoryStore, self).__getitem__(key))
+
+    def __setitem__(self, key, value):
+        value = self._pack(value)
+        with self._lock:
+            super(MemoryStore, self).__setitem__(key, value)
+
+    def set_many(self, mapping):
+        '''
+        Stores several objects at once.
+
+        :argument mapping: mapping of keys to objects
+        '''
+        packed = dict((k, self._pack(v)) for k, v in items(mapping))
+        with self._lock:
+            self._store.update(packed)
 
-    __setitem__ = synchronized(SimpleStore.__setitem__)
     __delitem__ = synchronized(SimpleStore.__delitem__)
+    get_many = shared(SimpleStore.get_many)
+    delete_many = synchronized(SimpleStore.delete_many)
 
 
 class ClientStore(BaseStore):
@@ -96,6 +117,29 @@ class SyncStore(ClientStore):
         except AttributeError:
             pass
 
+    def set_many(self, mapping):
+        # sync once for the whole batch instead of once per key
+        setitem = super(SyncStore, self).__setitem__
+        for key, value in items(mapping):
+            setitem(key, value)
+        try:
+            self.sync()
+        except AttributeError:
+            pass
+
+    def delete_many(self, keys):
+        # sync once for the whole batch instead of once per key
+        delitem = super(SyncStore, self).__delitem__
+        for key in keys:
+            try:
+                delitem(key)
+            except KeyError:
+                pass
+        try:
+            self.sync()
+        except AttributeError:
+            pass
+
 
 class DBMStore(SyncStore):
 
@@ -136,11 +180,25 @@ class FileStore(FileBase, BaseStore):
     Where the path is a URI path to a directory on a local filesystem.
     Alternatively, a native pathname to the directory can be passed as the
     'engine' argument.
+
+    See :class:`shove.base.FileBase` for the `fanout`, `manifest`,
+    `durable`, and `mmap` keywords.
     '''
 
     init = 'file://'
 
     def clear(self):
         '''Clear all objects from store.'''
-        shutil.rmtree(self._dir)
-        self._createdir()
+        manifest = self._keys is not None
+        self._closemanifest()
+        # trained compression dictionaries outlive the objects
+        for name in listdir(self._dir):
+            if name == '.zdict':
+                continue
+            path = join(self._dir, name)
+            if isdir(path):
+                shutil.rmtree(path)
+            else:
+                remove(path)
+        if manifest:
+            self._openmanifest()
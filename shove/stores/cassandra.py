@@ -7,7 +7,7 @@ The shove URI for a cassandra-based store is:
 cassandra://<host>:<port>/<keyspace>/<columnFamily>
 '''
 
-from stuf.six import native
+from stuf.six import items, native
 
 try:
     import pycassa
@@ -68,6 +68,20 @@ class CassandraStore(SimpleStore):
         except pycassa.NotFoundException:
             raise KeyError(key)
 
+    def get_many(self, keys):
+        loads = self.loads
+        return dict(
+            (k, loads(v['key'])) for k, v in
+            items(self._store.multiget(list(keys), columns=['key']))
+            if 'key' in v
+        )
+
+    def set_many(self, mapping):
+        dumps = self.dumps
+        self._store.batch_insert(
+            dict((k, dict(key=dumps(v))) for k, v in items(mapping))
+        )
+
     def __len__(self):
         return len(list(self._store.get_range()))
 
@@ -15,6 +15,8 @@ try:
 except ImportError:
     raise ImportError('requires py-leveldb library')
 
+from stuf.six import items
+
 from shove.store import ClientStore
 
 __all__ = ['LevelDBStore']
@@ -46,3 +48,16 @@ class LevelDBStore(ClientStore):
 
     def __iter__(self):
         return self._store.RangeIter(include_value=False)
+
+    def set_many(self, mapping):
+        batch = leveldb.WriteBatch()
+        dumps = self.dumps
+        for key, value in items(mapping):
+            batch.Put(key, dumps(value))
+        self._store.Write(batch)
+
+    def delete_many(self, keys):
+        batch = leveldb.WriteBatch()
+        for key in keys:
+            batch.Delete(key)
+        self._store.Write(batch)
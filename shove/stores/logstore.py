@@ -0,0 +1,464 @@
+# -*- coding: utf-8 -*-
+'''
+Append-only log-structured store.
+
+shove's URI for log stores follows the form:
+
+log://<path>
+
+Where <path> is a URL path to a directory on a local filesystem.
+Alternatively, a native pathname to the directory can be passed as the
+'engine' argument.
+
+Values are appended to segment files and found through an in-memory index of
+keys to (segment, offset, length) that is rebuilt from per-segment hint files
+at startup (the Bitcask design). Overwritten and deleted values stay on disk
+until `compact()` copies the live values into new segments.
+Pass `mmap=True` to read values through memory maps of the segments.
+'''
+
+from zlib import crc32
+from struct import Struct
+from mmap import mmap, ACCESS_READ
+from os.path import exists, join, getsize
+from threading import Condition, Lock, Thread
+from os import listdir, remove, makedirs, fsync
+
+from stuf.six import PY3, items
+
+from shove.base import DURABLE
+from shove.store import BaseStore
+from shove._compat import (
+    url2pathname, synchronized, tonative, replace, fsyncpath, unmap,
+)
+
+__all__ = ['LogStore']
+
+# record header: checksum, key length, value length
+HEADER = Struct('>III')
+CRC = Struct('>I')
+SIZES = Struct('>II')
+# hint record: key length, value length, value offset
+HINT = Struct('>IIQ')
+# value length marking a deleted key
+TOMBSTONE = 0xFFFFFFFF
+
+
+def _tobytes(key):
+    return key if isinstance(key, bytes) else key.encode('utf-8')
+
+
+def _record(key, value):
+    # packs a record for raw key `key` into a list of segments (`value` is
+    # None for a tombstone, bytes, or a list of segments written as they are)
+    if value is None:
+        parts = [SIZES.pack(len(key), TOMBSTONE) + key]
+    else:
+        if not isinstance(value, list):
+            value = [value]
+        size = sum(len(part) for part in value)
+        parts = [SIZES.pack(len(key), size) + key] + value
+    crc = 0
+    for part in parts:
+        crc = crc32(part, crc)
+    return [CRC.pack(crc & 0xffffffff)] + parts
+
+
+class LogStore(BaseStore):
+
+    '''
+    Log-structured object store.
+    '''
+
+    init = 'log://'
+
+    def __init__(self, engine, **kw):
+        super(LogStore, self).__init__(engine, **kw)
+        if engine.startswith(self.init):
+            engine = url2pathname(engine.split('://')[1])
+        self._dir = engine
+        if self._zdicts.path is None:
+            self._zdicts.path = join(engine, '.zdict')
+        if not exists(self._dir):
+            makedirs(self._dir)
+        # keyword segment_size: bytes written before starting a new segment
+        self._segment_size = kw.get('segment_size', 1 << 26)
+        # keyword durable: as for file stores (see shove.base.FileBase);
+        # with 'batch' single writes become durable with the next batch
+        self._durable = kw.get('durable', 'none')
+        if self._durable not in DURABLE:
+            raise ValueError(
+                'durable must be one of {0}'.format(', '.join(DURABLE))
+            )
+        # keyword compact_ratio: share of dead bytes that starts a background
+        # compaction when a segment fills (None to only compact explicitly)
+        self._compact_ratio = kw.get('compact_ratio')
+        # keyword mmap: read values through memory maps of the segments
+        self._mmap = kw.get('mmap', False) and PY3
+        self._lock = Condition()
+        self._compacting = Lock()
+        self._load()
+
+    @synchronized
+    def __getitem__(self, key):
+        try:
+            entry = self._index[key]
+        except KeyError:
+            raise KeyError(key)
+        return self._value(entry)
+
+    @synchronized
+    def __setitem__(self, key, value):
+        self._append(
+            [(key, self._dumpparts(value))], self._durable == 'always',
+        )
+
+    @synchronized
+    def __delitem__(self, key):
+        if key not in self._index:
+            raise KeyError(key)
+        self._append([(key, None)], self._durable == 'always')
+
+    @synchronized
+    def __iter__(self):
+        return iter(list(self._index))
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def __len__(self):
+        return len(self._index)
+
+    @synchronized
+    def get_many(self, keys):
+        value = self._value
+        index = self._index
+        return dict((key, value(index[key])) for key in keys if key in index)
+
+    @synchronized
+    def set_many(self, mapping):
+        dumps = self._dumpparts
+        self._append(
+            [(key, dumps(value)) for key, value in items(mapping)],
+            self._durable != 'none',
+        )
+
+    @synchronized
+    def delete_many(self, keys):
+        index = self._index
+        self._append(
+            [(key, None) for key in keys if key in index],
+            self._durable != 'none',
+        )
+
+    def clear(self):
+        '''Removes all objects and segments.'''
+        with self._compacting:
+            with self._lock:
+                self._shut()
+                for name in listdir(self._dir):
+                    if name.endswith(('.log', '.hint')):
+                        remove(join(self._dir, name))
+                self._load()
+
+    def close(self):
+        '''Seals the active segment and closes all files.'''
+        with self._compacting:
+            with self._lock:
+                if self._writer is not None:
+                    self._seal(self._segment, self._writer, self._hints)
+                    self._writer = None
+                self._shut()
+
+    def compact(self):
+        '''
+        Copies live values out of closed segments into new segments and
+        removes the old ones. Reads and writes can continue while values are
+        copied.
+        '''
+        with self._compacting:
+            with self._lock:
+                self._rotate()
+                old = [i for i in self._segments if i != self._segment]
+                if not old:
+                    return
+                closed = set(old)
+                live = [
+                    (key, entry) for key, entry in items(self._index)
+                    if entry[0] in closed
+                ]
+            # new segments sort after the old ones and before the active one
+            major, minor = old[-1]
+            outputs = []
+            moved = []
+            readers = dict()
+            writer = None
+            written = 0
+            hints = []
+            try:
+                for key, entry in live:
+                    if writer is None or written >= self._segment_size:
+                        if writer is not None:
+                            self._seal(outputs[-1], writer, hints)
+                        minor += 1
+                        outputs.append((major, minor))
+                        writer = open(self._path(outputs[-1], '.log'), 'wb')
+                        written = 0
+                        hints = []
+                    reader = readers.get(entry[0])
+                    if reader is None:
+                        reader = readers[entry[0]] = open(
+                            self._path(entry[0], '.log'), 'rb',
+                        )
+                    reader.seek(entry[1])
+                    value = reader.read(entry[2])
+                    raw = _tobytes(key)
+                    record = _record(raw, value)
+                    writer.writelines(record)
+                    size = sum(len(part) for part in record)
+                    offset = written + HEADER.size + len(raw)
+                    hints.append((raw, len(value), offset))
+                    moved.append((key, entry, (
+                        outputs[-1], offset, len(value), size,
+                    )))
+                    written += size
+                if writer is not None:
+                    self._seal(outputs[-1], writer, hints)
+                    writer = None
+            finally:
+                if writer is not None:
+                    writer.close()
+                for reader in readers.values():
+                    reader.close()
+            with self._lock:
+                index = self._index
+                for segment in outputs:
+                    self._bytes[segment] = getsize(self._path(segment, '.log'))
+                    self._live[segment] = 0
+                # keys changed during the copy keep their newer values
+                for key, entry, new in moved:
+                    if index.get(key) == entry:
+                        index[key] = new
+                        self._live[new[0]] += new[3]
+                for segment in old:
+                    reader = self._readers.pop(segment, None)
+                    if reader is not None:
+                        reader.close()
+                    mapped = self._maps.pop(segment, None)
+                    if mapped is not None:
+                        unmap(mapped)
+                    del self._bytes[segment]
+                    del self._live[segment]
+                    for ext in ('.hint', '.log'):
+                        try:
+                            remove(self._path(segment, ext))
+                        except OSError:
+                            pass
+                self._segments = sorted(
+                    set(self._segments).difference(old).union(outputs)
+                )
+                fsyncpath(self._dir)
+
+    def _append(self, records, sync):
+        # appends (key, value) records (value None deletes the key) to the
+        # active segment and updates the index
+        index = self._index
+        live = self._live
+        for key, value in records:
+            if self._written >= self._segment_size:
+                self._rotate()
+            raw = _tobytes(key)
+            record = _record(raw, value)
+            self._writer.writelines(record)
+            segment = self._segment
+            offset = self._written + HEADER.size + len(raw)
+            size = sum(len(part) for part in record)
+            length = size - HEADER.size - len(raw)
+            old = index.pop(key, None)
+            if old is not None:
+                live[old[0]] -= old[3]
+            if value is None:
+                self._hints.append((raw, TOMBSTONE, offset))
+            else:
+                self._hints.append((raw, length, offset))
+                index[key] = (segment, offset, length, size)
+                live[segment] += size
+            self._bytes[segment] += size
+            self._written += size
+        self._writer.flush()
+        if sync:
+            fsync(self._writer.fileno())
+
+    def _load(self):
+        # rebuilds the index from hint files, scanning segments without one
+        self._index = dict()
+        self._bytes = dict()
+        self._live = dict()
+        self._readers = dict()
+        self._maps = dict()
+        self._segments = sorted(
+            tuple(int(i) for i in name[:-4].split('-'))
+            for name in listdir(self._dir) if name.endswith('.log')
+        )
+        hints = []
+        for segment in self._segments:
+            path = self._path(segment, '.log')
+            if exists(self._path(segment, '.hint')):
+                hints = self._readhints(segment)
+                size = getsize(path)
+            else:
+                hints, size = self._scan(segment)
+                # drop a record torn by a crash mid-append
+                if size < getsize(path):
+                    with open(path, 'r+b') as data:
+                        data.truncate(size)
+            self._bytes[segment] = size
+            self._live[segment] = 0
+            self._replay(segment, hints)
+        # keep appending to the newest segment if it has room
+        if self._segments and size < self._segment_size:
+            self._segment = self._segments[-1]
+            self._hints = hints
+            try:
+                remove(self._path(self._segment, '.hint'))
+            except OSError:
+                pass
+        else:
+            major = self._segments[-1][0] + 1 if self._segments else 0
+            self._segment = (major, 0)
+            self._segments.append(self._segment)
+            self._bytes[self._segment] = 0
+            self._live[self._segment] = 0
+            self._hints = []
+        self._writer = open(self._path(self._segment, '.log'), 'ab')
+        self._written = self._bytes[self._segment]
+
+    def _path(self, segment, ext):
+        return join(self._dir, '{0:010d}-{1:04d}{2}'.format(
+            segment[0], segment[1], ext,
+        ))
+
+    def _read(self, entry):
+        # reads a value with one seek into its segment
+        reader = self._readers.get(entry[0])
+        if reader is None:
+            reader = self._readers[entry[0]] = open(
+                self._path(entry[0], '.log'), 'rb',
+            )
+        reader.seek(entry[1])
+        return reader.read(entry[2])
+
+    def _readhints(self, segment):
+        hints = []
+        with open(self._path(segment, '.hint'), 'rb') as data:
+            data = data.read()
+        offset = 0
+        while offset < len(data):
+            klen, vlen, position = HINT.unpack_from(data, offset)
+            offset += HINT.size
+            hints.append((data[offset:offset + klen], vlen, position))
+            offset += klen
+        return hints
+
+    def _replay(self, segment, hints):
+        index = self._index
+        live = self._live
+        for raw, vlen, offset in hints:
+            key = tonative(raw)
+            old = index.pop(key, None)
+            if old is not None:
+                live[old[0]] -= old[3]
+            if vlen != TOMBSTONE:
+                size = HEADER.size + len(raw) + vlen
+                index[key] = (segment, offset, vlen, size)
+                live[segment] += size
+
+    def _rotate(self):
+        # seals the active segment and starts a new one
+        if not self._written:
+            return
+        self._seal(self._segment, self._writer, self._hints)
+        self._segment = (self._segment[0] + 1, 0)
+        self._segments.append(self._segment)
+        self._bytes[self._segment] = 0
+        self._live[self._segment] = 0
+        self._hints = []
+        self._writer = open(self._path(self._segment, '.log'), 'ab')
+        self._written = 0
+        ratio = self._compact_ratio
+        if ratio is not None and not self._compacting.locked():
+            total = sum(self._bytes.values())
+            if total - sum(self._live.values()) > ratio * total:
+                thread = Thread(target=self.compact)
+                thread.daemon = True
+                thread.start()
+
+    def _scan(self, segment):
+        # reads records until the end of a segment or the first bad record
+        hints = []
+        offset = 0
+        with open(self._path(segment, '.log'), 'rb') as data:
+            while True:
+                header = data.read(HEADER.size)
+                if len(header) < HEADER.size:
+                    break
+                crc, klen, vlen = HEADER.unpack(header)
+                size = klen + (0 if vlen == TOMBSTONE else vlen)
+                body = data.read(size)
+                if len(body) < size or crc32(
+                    header[4:] + body
+                ) & 0xffffffff != crc:
+                    break
+                hints.append((body[:klen], vlen, offset + HEADER.size + klen))
+                offset += HEADER.size + size
+        return hints, offset
+
+    def _seal(self, segment, writer, hints):
+        # makes a segment durable and writes its hint file
+        writer.flush()
+        fsync(writer.fileno())
+        writer.close()
+        path = self._path(segment, '.hint')
+        with open(path + '.tmp', 'wb') as data:
+            data.write(b''.join(
+                HINT.pack(len(raw), vlen, offset) + raw
+                for raw, vlen, offset in hints
+            ))
+            data.flush()
+            fsync(data.fileno())
+        replace(path + '.tmp', path)
+        fsyncpath(self._dir)
+
+    def _shut(self):
+        # closes open files
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        for reader in self._readers.values():
+            reader.close()
+        self._readers.clear()
+        for mapped in self._maps.values():
+            unmap(mapped)
+        self._maps.clear()
+
+    def _value(self, entry):
+        # loads a value, straight from a segment's memory map if enabled
+        if not self._mmap:
+            return self.loads(self._read(entry))
+        segment, offset, length = entry[:3]
+        mapped = self._maps.get(segment)
+        # the active segment grows past its last mapping
+        if mapped is None or len(mapped) < offset + length:
+            if mapped is not None:
+                unmap(mapped)
+            with open(self._path(segment, '.log'), 'rb') as data:
+                mapped = self._maps[segment] = mmap(
+                    data.fileno(), 0, access=ACCESS_READ,
+                )
+        whole = memoryview(mapped)
+        view = whole[offset:offset + length]
+        try:
+            return self.loads(view)
+        finally:
+            view.release()
+            whole.release()
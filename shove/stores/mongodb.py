@@ -13,6 +13,8 @@ try:
 except ImportError:
     raise ImportError('requires pymongo library')
 
+from stuf.six import items
+
 from shove._compat import urlsplit
 from shove.store import SimpleStore
 
@@ -49,6 +51,27 @@ class MongoDBStore(SimpleStore):
     def __len__(self):
         return self._store.count()
 
+    def get_many(self, keys):
+        loads = self.loads
+        return dict(
+            (item['key'], loads(item['value'])) for item in
+            self._store.find(dict(key={'$in': list(keys)}))
+        )
+
+    def set_many(self, mapping):
+        if mapping:
+            # insert or replace every document in one bulk operation
+            bulk = self._store.initialize_unordered_bulk_op()
+            dumps = self.dumps
+            for k, v in items(mapping):
+                bulk.find(dict(key=k)).upsert().replace_one(
+                    dict(key=k, value=Binary(dumps(v)))
+                )
+            bulk.execute()
+
+    def delete_many(self, keys):
+        self._store.remove(dict(key={'$in': list(keys)}))
+
     def __iter__(self):
         for key in self._store.find(
             dict(key={'$exists': True}), fields=['key'],
@@ -5,6 +5,10 @@ Redis-based object store
 The shove URI for a redis-based store is:
 
 redis://<host>:<port>/<db>
+
+Pass the `prefix` keyword to scope the store to keys starting with that
+prefix so several stores can share one Redis database. Trained compression
+dictionaries are kept in a hash named after the prefix and a NUL.
 '''
 
 try:
@@ -12,8 +16,9 @@ try:
 except ImportError:
     raise ImportError('requires the redis library')
 
-from shove._compat import urlsplit
+from stuf.six import items
 
+from shove._compat import urlsplit, tonative
 from shove.store import BaseStore
 
 __all__ = ['RedisStore']
@@ -32,21 +37,120 @@ class RedisStore(BaseStore):
         self._hostname = spliturl.hostname
         self._port = spliturl.port
         self._store = redis.Redis(spliturl.hostname, spliturl.port, self._db)
+        # key namespace
+        self._prefix = kw.get('prefix', '')
+        # set of the keys in a namespace (the NUL keeps it out of the way of
+        # stored keys)
+        self._index = self._prefix + '\x00keys'
+        # hash of trained compression dictionaries
+        self._zdict = self._prefix + '\x00zdict'
+        self._zdicts.bind(self._readzdicts, self._writezdict)
+        # number of keys requested per SCAN call
+        self._scancount = kw.get('scan_count', 1000)
+
+    def __getitem__(self, key):
+        value = self._store.get(self._prefix + key)
+        if value is None:
+            raise KeyError(key)
+        return self.loads(value)
+
+    def __setitem__(self, key, value):
+        if self._prefix:
+            pipe = self._store.pipeline()
+            pipe.set(self._prefix + key, self.dumps(value))
+            pipe.sadd(self._index, key)
+            pipe.execute()
+        else:
+            self._store.set(key, self.dumps(value))
+
+    def __delitem__(self, key):
+        if self._prefix:
+            pipe = self._store.pipeline()
+            pipe.delete(self._prefix + key)
+            pipe.srem(self._index, key)
+            deleted = pipe.execute()[0]
+        else:
+            deleted = self._store.delete(key)
+        if not deleted:
+            raise KeyError(key)
 
     def __contains__(self, key):
-        return self._store.exists(key)
+        return bool(self._store.exists(self._prefix + key))
 
     def __len__(self):
-        return len(self._store.keys())
-
-    def clear(self):
-        self._store.flushall()
+        if self._prefix:
+            return self._store.scard(self._index)
+        pipe = self._store.pipeline()
+        pipe.dbsize()
+        pipe.exists(self._zdict)
+        size, zdict = pipe.execute()
+        return size - bool(zdict)
 
     def __iter__(self):
-        return iter(self._store.keys())
+        # cursor-based so large keyspaces never block the server
+        if self._prefix:
+            keys = self._store.sscan_iter(self._index, count=self._scancount)
+        else:
+            keys = self._store.scan_iter(count=self._scancount)
+        zdict = self._zdict
+        for key in keys:
+            key = tonative(key)
+            if key != zdict:
+                yield key
 
-    def keys(self):
-        return self._store.keys()
-
-    def setdefault(self, key, default=None):
-        return self._store.getset(key, default)
+    def clear(self):
+        if self._prefix:
+            prefix, index = self._prefix, self._index
+            while True:
+                # drain the namespace in chunks of scan_count keys
+                keys = self._store.srandmember(index, self._scancount)
+                if not keys:
+                    break
+                pipe = self._store.pipeline()
+                pipe.delete(*list(prefix + tonative(k) for k in keys))
+                pipe.srem(index, *keys)
+                pipe.execute()
+            self._store.delete(index)
+        else:
+            self._store.flushdb()
+
+    def _readzdicts(self):
+        return self._store.hgetall(self._zdict)
+
+    def _writezdict(self, version, data):
+        return bool(self._store.hsetnx(self._zdict, version, data))
+
+    def get_many(self, keys):
+        keys = list(keys)
+        if not keys:
+            return dict()
+        prefix, loads = self._prefix, self.loads
+        # one MGET round trip for the whole batch
+        return dict(
+            (k, loads(v)) for k, v in
+            zip(keys, self._store.mget(list(prefix + k for k in keys)))
+            if v is not None
+        )
+
+    def set_many(self, mapping):
+        if not mapping:
+            return
+        prefix, dumps = self._prefix, self.dumps
+        # one pipelined round trip for the whole batch
+        pipe = self._store.pipeline(transaction=False)
+        for key, value in items(mapping):
+            pipe.set(prefix + key, dumps(value))
+        if prefix:
+            pipe.sadd(self._index, *list(mapping))
+        pipe.execute()
+
+    def delete_many(self, keys):
+        keys = list(keys)
+        if not keys:
+            return
+        prefix = self._prefix
+        pipe = self._store.pipeline(transaction=False)
+        pipe.delete(*list(prefix + k for k in keys))
+        if prefix:
+            pipe.srem(self._index, *keys)
+        pipe.execute()
@@ -19,6 +19,7 @@ try:
 except ImportError:
     raise ImportError('requires boto library')
 
+from shove.base import Segments
 from shove.store import BaseStore
 
 __all__ = ['S3Store']
@@ -65,7 +66,12 @@ class S3Store(BaseStore):
     def __setitem__(self, key, value):
         rkey = Key(self._store)
         rkey.key = key
-        rkey.set_contents_from_string(self.dumps(value))
+        parts = self._dumpparts(value)
+        if len(parts) > 2:
+            # upload values with out-of-band buffers segment by segment
+            rkey.set_contents_from_file(Segments(parts))
+        else:
+            rkey.set_contents_from_string(b''.join(parts))
         # flag that the store has been updated
         self._updated = True
 
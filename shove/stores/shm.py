@@ -0,0 +1,348 @@
+# -*- coding: utf-8 -*-
+'''
+Shared-memory object store.
+
+shove's URI for shared-memory stores follows the form:
+
+shm://<name>
+
+Where <name> names a file in /dev/shm (or the temporary directory where
+there is no /dev/shm) that every process on the host opening the same name
+maps into memory, so they all share one copy of the data. An absolute path
+can be given instead of a name.
+
+The file holds a header, an open addressing hash table of fixed-size slots
+and an append-only arena of records. Processes take a shared `flock` on the
+file to read and an exclusive one to write. When the arena or the table
+fills up, the live records are copied into a larger layout, and other
+processes remap the file on their next access. Keywords `slots` and `size`
+set the initial number of hash slots and file size in bytes.
+'''
+
+from zlib import crc32
+from struct import Struct
+from tempfile import gettempdir
+from threading import Condition
+from contextlib import contextmanager
+from mmap import mmap
+from os.path import isabs, isdir, join
+from os import (
+    O_CREAT, O_RDWR, close, fstat, ftruncate, getpid, open as osopen,
+)
+try:
+    from fcntl import flock, LOCK_EX, LOCK_SH, LOCK_UN
+except ImportError:
+    raise ImportError('requires fcntl (a POSIX system)')
+
+from stuf.six import items
+
+from shove.store import BaseStore
+from shove._compat import synchronized, tonative, unmap
+
+__all__ = ['ShmStore']
+
+MAGIC = b'shove\x00\x00\x01'
+# header: magic, slots, file size, arena end, live records, deleted slots,
+# dead arena bytes
+HEADER = Struct('>8sQQQQQQ')
+# hash table slot: key checksum, record length, record offset
+SLOT = Struct('>IIQ')
+# record: key length, expiration time (0 for never)
+RECORD = Struct('>Id')
+# where the hash table starts
+TABLE = 64
+# record offsets marking a free and a deleted slot
+EMPTY = 0
+DELETED = 1
+# directory for named files
+SHMDIR = '/dev/shm' if isdir('/dev/shm') else gettempdir()
+
+
+def _tobytes(key):
+    return key if isinstance(key, bytes) else key.encode('utf-8')
+
+
+def _hash(key):
+    # process-independent hash of a raw key
+    return crc32(key) & 0xffffffff
+
+
+class ShmBase(object):
+
+    '''Base for shared-memory stores and caches.'''
+
+    init = 'shm://'
+
+    def __init__(self, engine, **kw):
+        super(ShmBase, self).__init__(engine, **kw)
+        if engine.startswith(self.init):
+            engine = engine.split('://', 1)[1]
+        self._path = engine if isabs(engine) else join(
+            SHMDIR, 'shove-' + engine,
+        )
+        if self._zdicts.path is None:
+            self._zdicts.path = self._path + '.zdict'
+        # keywords slots and size: initial hash slots and file size
+        self._initslots = kw.get('slots', 4096)
+        self._initsize = kw.get('size', 1 << 22)
+        # threads share one file descriptor so they take turns
+        self._lock = Condition()
+        self._fd = self._map = None
+        self._open()
+
+    @synchronized
+    def __contains__(self, key):
+        with self._flock(LOCK_SH):
+            return self._find(_tobytes(key))[0] is not None
+
+    @synchronized
+    def __iter__(self):
+        with self._flock(LOCK_SH):
+            keys = list(tonative(key) for _, key, _ in self._scan())
+        return iter(keys)
+
+    @synchronized
+    def __len__(self):
+        with self._flock(LOCK_SH):
+            return self._count()
+
+    @synchronized
+    def close(self):
+        '''Unmaps and closes the shared file.'''
+        if self._fd is not None:
+            unmap(self._map)
+            close(self._fd)
+            self._fd = self._map = None
+
+    @contextmanager
+    def _flock(self, mode):
+        # holds the file lock (the caller holds the thread lock)
+        if getpid() != self._pid:
+            # a forked child gets a file description of its own so its
+            # locks exclude the parent's
+            unmap(self._map)
+            close(self._fd)
+            self._map = None
+            self._open()
+        flock(self._fd, mode)
+        try:
+            # follow layouts grown by other processes
+            size = HEADER.unpack_from(self._map, 0)[2]
+            if size != len(self._map):
+                self._remap(size)
+            yield
+        finally:
+            flock(self._fd, LOCK_UN)
+
+    def _open(self):
+        self._pid = getpid()
+        self._fd = fd = osopen(self._path, O_RDWR | O_CREAT, 0o600)
+        flock(fd, LOCK_EX)
+        try:
+            size = fstat(fd).st_size
+            if size >= TABLE:
+                self._remap(size)
+                if self._map[:len(MAGIC)] == MAGIC:
+                    return
+            self._layout(self._initslots, self._initsize, [])
+        finally:
+            flock(fd, LOCK_UN)
+
+    def _remap(self, size):
+        if self._map is not None:
+            unmap(self._map)
+        self._map = mmap(self._fd, size)
+
+    def _layout(self, slots, size, records):
+        # writes a fresh table and arena holding (checksum, record) pairs
+        arena = TABLE + slots * SLOT.size
+        size = max(size, arena + sum(len(r) for _, r in records))
+        current = fstat(self._fd).st_size
+        # the file never shrinks so older maps of it stay valid
+        if size > current:
+            ftruncate(self._fd, size)
+        else:
+            size = current
+        self._remap(size)
+        m = self._map
+        m[TABLE:arena] = b'\x00' * (arena - TABLE)
+        used = arena
+        for crc, record in records:
+            at = self._find(None, crc, slots)[1]
+            m[used:used + len(record)] = record
+            SLOT.pack_into(m, at, crc, len(record), used)
+            used += len(record)
+        HEADER.pack_into(m, 0, MAGIC, slots, size, used, len(records), 0, 0)
+
+    def _count(self):
+        # number of live records
+        return HEADER.unpack_from(self._map, 0)[4]
+
+    def _find(self, key, crc=None, slots=None):
+        # returns the slot holding `key` (None if missing) and the first
+        # slot it could be stored in
+        m = self._map
+        if crc is None:
+            crc = _hash(key)
+        if slots is None:
+            slots = HEADER.unpack_from(m, 0)[1]
+        start, free = crc % slots, None
+        for i in range(slots):
+            at = TABLE + ((start + i) % slots) * SLOT.size
+            check, length, offset = SLOT.unpack_from(m, at)
+            if offset == EMPTY:
+                return None, at if free is None else free
+            if offset == DELETED:
+                if free is None:
+                    free = at
+            elif check == crc and key is not None:
+                size = RECORD.unpack_from(m, offset)[0]
+                begin = offset + RECORD.size
+                if m[begin:begin + size] == key:
+                    return at, free
+        return None, free
+
+    def _scan(self):
+        # yields (slot, raw key, expiration time) for every live record
+        m = self._map
+        for i in range(HEADER.unpack_from(m, 0)[1]):
+            at = TABLE + i * SLOT.size
+            offset = SLOT.unpack_from(m, at)[2]
+            if offset > DELETED:
+                size, expires = RECORD.unpack_from(m, offset)
+                begin = offset + RECORD.size
+                yield at, m[begin:begin + size], expires
+
+    def _get(self, key):
+        # returns the expiration time and stored bytes of `key`
+        at = self._find(_tobytes(key))[0]
+        if at is None:
+            raise KeyError(key)
+        m = self._map
+        _, length, offset = SLOT.unpack_from(m, at)
+        size, expires = RECORD.unpack_from(m, offset)
+        return expires, m[offset + RECORD.size + size:offset + length]
+
+    def _put(self, key, expires, value):
+        # stores bytes `value` for `key` (the caller holds LOCK_EX)
+        key = _tobytes(key)
+        record = RECORD.pack(len(key), expires) + key + value
+        m = self._map
+        _, slots, size, used, count, deleted, dead = HEADER.unpack_from(m, 0)
+        # keep the table at most three quarters full
+        if used + len(record) > size or 4 * (count + deleted + 1) > 3 * slots:
+            self._grow(len(record))
+            m = self._map
+            _, slots, size, used, count, deleted, dead = HEADER.unpack_from(
+                m, 0,
+            )
+        crc = _hash(key)
+        at, free = self._find(key, crc, slots)
+        if at is not None:
+            dead += SLOT.unpack_from(m, at)[1]
+        else:
+            at = free
+            if SLOT.unpack_from(m, at)[2] == DELETED:
+                deleted -= 1
+            count += 1
+        m[used:used + len(record)] = record
+        SLOT.pack_into(m, at, crc, len(record), used)
+        HEADER.pack_into(
+            m, 0, MAGIC, slots, size, used + len(record), count, deleted,
+            dead,
+        )
+
+    def _delete(self, at):
+        # frees the slot at `at` (the caller holds LOCK_EX)
+        m = self._map
+        _, slots, size, used, count, deleted, dead = HEADER.unpack_from(m, 0)
+        crc, length, _ = SLOT.unpack_from(m, at)
+        SLOT.pack_into(m, at, crc, length, DELETED)
+        HEADER.pack_into(
+            m, 0, MAGIC, slots, size, used, count - 1, deleted + 1,
+            dead + length,
+        )
+
+    def _grow(self, extra):
+        # copies the live records into a layout with room for `extra` more
+        # bytes and one more record
+        m = self._map
+        _, slots, size, _, count, _, _ = HEADER.unpack_from(m, 0)
+        records = list()
+        for i in range(slots):
+            crc, length, offset = SLOT.unpack_from(m, TABLE + i * SLOT.size)
+            if offset > DELETED:
+                records.append((crc, m[offset:offset + length]))
+        while 2 * (count + 1) > slots:
+            slots *= 2
+        needed = TABLE + slots * SLOT.size + extra + sum(
+            len(r) for _, r in records
+        )
+        if needed > size:
+            size = max(needed, 2 * size)
+        self._layout(slots, size, records)
+
+    def _remove(self, keys):
+        # deletes `keys` and returns how many were there
+        removed = 0
+        for key in keys:
+            at = self._find(_tobytes(key))[0]
+            if at is not None:
+                self._delete(at)
+                removed += 1
+        return removed
+
+
+class ShmStore(ShmBase, BaseStore):
+
+    '''
+    Shared-memory object store.
+    '''
+
+    @synchronized
+    def __getitem__(self, key):
+        with self._flock(LOCK_SH):
+            value = self._get(key)[1]
+        return self.loads(value)
+
+    def __setitem__(self, key, value):
+        value = self.dumps(value)
+        with self._lock:
+            with self._flock(LOCK_EX):
+                self._put(key, 0, value)
+
+    @synchronized
+    def __delitem__(self, key):
+        with self._flock(LOCK_EX):
+            if not self._remove([key]):
+                raise KeyError(key)
+
+    def get_many(self, keys):
+        found = dict()
+        with self._lock:
+            with self._flock(LOCK_SH):
+                for key in keys:
+                    try:
+                        found[key] = self._get(key)[1]
+                    except KeyError:
+                        pass
+        loads = self.loads
+        return dict((k, loads(v)) for k, v in items(found))
+
+    def set_many(self, mapping):
+        dumps = self.dumps
+        values = list((k, dumps(v)) for k, v in items(mapping))
+        with self._lock:
+            with self._flock(LOCK_EX):
+                for key, value in values:
+                    self._put(key, 0, value)
+
+    @synchronized
+    def delete_many(self, keys):
+        with self._flock(LOCK_EX):
+            self._remove(keys)
+
+    @synchronized
+    def clear(self):
+        with self._flock(LOCK_EX):
+            self._layout(self._initslots, 0, [])
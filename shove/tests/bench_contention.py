@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+'''
+shove lock contention benchmark
+
+Runs a mixed read and write workload on the thread-safe memory backends
+from a growing number of threads and prints operations per second:
+
+python -m shove.tests.bench_contention [seconds per run]
+'''
+
+import sys
+import random
+from threading import Event, Thread
+
+from shove._compat import clock
+from shove._imports import cache_backend, store_backend
+
+# backends to compare
+BACKENDS = (
+    ('memory:// store', store_backend, 'memory://'),
+    ('memory:// cache', cache_backend, 'memory://'),
+    ('memlru:// cache', cache_backend, 'memlru://'),
+)
+THREADS = (1, 4, 16, 32)
+KEYS = 1000
+# share of operations that are reads
+READS = 0.9
+
+
+def _worker(backend, stop, counts):
+    keys = list(range(KEYS))
+    value = dict(name='x' * 100, ids=list(range(20)))
+    done = 0
+    while not stop.is_set():
+        for _ in range(100):
+            key = random.choice(keys)
+            if random.random() < READS:
+                try:
+                    backend[key]
+                except KeyError:
+                    pass
+            else:
+                backend[key] = value
+        done += 100
+    counts.append(done)
+
+
+def run(factory, uri, threads, seconds):
+    '''
+    Returns operations per second for `threads` threads using a backend.
+
+    :argument factory: backend loader
+    :argument uri: backend URI
+    :argument threads: number of threads
+    :argument seconds: how long to run
+    '''
+    backend = factory(uri, max_entries=KEYS * 2)
+    backend.set_many(dict((key, key) for key in range(KEYS)))
+    stop, counts = Event(), list()
+    workers = list(
+        Thread(target=_worker, args=(backend, stop, counts))
+        for _ in range(threads)
+    )
+    start = clock()
+    for worker in workers:
+        worker.start()
+    stop.wait(seconds)
+    stop.set()
+    for worker in workers:
+        worker.join()
+    return sum(counts) / (clock() - start)
+
+
+def main(seconds=2.0):
+    for name, factory, uri in BACKENDS:
+        for threads in THREADS:
+            print('%-16s %3d threads %12.0f ops/s' % (
+                name, threads, run(factory, uri, threads, seconds),
+            ))
+
+
+if __name__ == '__main__':
+    main(*[float(arg) for arg in sys.argv[1:2]])
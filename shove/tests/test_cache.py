@@ -29,6 +29,19 @@ class NoTimeout(object):
         del self.cache['test']
         self.assertEqual('test' in self.cache, False)
 
+    def test_get_many(self):
+        self.cache.set_many(dict(test='test', test2='test2'))
+        self.assertEqual(
+            self.cache.get_many(['test', 'test2', 'test3']),
+            dict(test='test', test2='test2'),
+        )
+
+    def test_delete_many(self):
+        self.cache.set_many(dict(test='test', test2='test2'))
+        self.cache.delete_many(['test', 'test3'])
+        self.assertEqual('test' in self.cache, False)
+        self.assertEqual(self.cache['test2'], 'test2')
+
 
 class Cache(NoTimeout):
 
@@ -41,6 +54,14 @@ class Cache(NoTimeout):
             cache['test']
         self.assertRaises(KeyError, tmp)
 
+    def test_set_ttl(self):
+        import time
+        self.cache.set('test', 'test', ttl=1)
+        self.cache.set('test2', 'test2', ttl=60)
+        time.sleep(2)
+        self.assertRaises(KeyError, self.cache.__getitem__, 'test')
+        self.assertEqual(self.cache['test2'], 'test2')
+
 
 class CacheCull(Cache):
 
@@ -52,7 +73,110 @@ class CacheCull(Cache):
         self.assertEquals(len(cache), 1)
 
 
-class TestSimpleCache(CacheCull, unittest.TestCase):
+class CachePolicy(CacheCull):
+
+    def test_lfu(self):
+        cache = self._makeone(self.initstring, max_entries=2, policy='lfu')
+        cache['test'] = 'test'
+        cache['test2'] = 'test2'
+        cache['test']
+        cache['test']
+        cache['test2']
+        cache['test3'] = 'test3'
+        self.assertEqual('test2' in cache, False)
+        self.assertEqual(cache['test'], 'test')
+
+    def test_ttl(self):
+        cache = self._makeone(self.initstring, max_entries=2, policy='ttl')
+        cache['test'] = 'test'
+        cache.timeout = 10
+        cache['test2'] = 'test2'
+        cache.timeout = 300
+        cache['test3'] = 'test3'
+        self.assertEqual('test2' in cache, False)
+        self.assertEqual(cache['test'], 'test')
+
+    def test_expired_first(self):
+        import time
+        cache = self._makeone(self.initstring, max_entries=2, policy='lfu')
+        cache.timeout = 1
+        cache['test'] = 'test'
+        cache['test']
+        cache['test']
+        cache.timeout = 300
+        time.sleep(1.5)
+        cache['test2'] = 'test2'
+        cache['test3'] = 'test3'
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache['test2'], 'test2')
+
+    def test_stale(self):
+        cache = self._makeone(self.initstring, timeout=-1, stale=60)
+        cache['test'] = 'test'
+        # the first reader of an expired entry reloads it...
+        self.assertRaises(KeyError, cache.__getitem__, 'test')
+        # ...while the others are served the stale value
+        self.assertEqual(cache['test'], 'test')
+        cache['test'] = 'test2'
+        self.assertRaises(KeyError, cache.__getitem__, 'test')
+        self.assertEqual(cache['test'], 'test2')
+        cache = self._makeone(self.initstring, timeout=-1)
+        cache['test'] = 'test'
+        self.assertRaises(KeyError, cache.__getitem__, 'test')
+        self.assertEqual('test' in cache, False)
+
+    def test_max_bytes_keeps_new(self):
+        for policy in ('random', 'lfu', 'ttl'):
+            cache = self._makeone(
+                self.initstring, max_bytes=250, policy=policy, sizer=len,
+            )
+            for i in range(10):
+                cache[str(i)] = 'x' * 100
+                self.assertEqual(cache[str(i)], 'x' * 100)
+            self.assertEqual(cache.stats()['bytes'] <= 250, True)
+            cache.delete_many(list(cache))
+
+
+class LRUCache(NoTimeout):
+
+    def test_lru(self):
+        cache = self._makeone(self.initstring, max_entries=2)
+        cache['test'] = 'test'
+        cache['test2'] = 'test2'
+        cache['test']
+        cache['test3'] = 'test3'
+        self.assertEqual(len(cache), 2)
+        self.assertEqual('test2' in cache, False)
+        self.assertEqual(cache['test'], 'test')
+
+    def test_max_bytes(self):
+        cache = self._makeone(self.initstring, max_bytes=250)
+        for i in range(10):
+            cache[str(i)] = 'x' * 200
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache['9'], 'x' * 200)
+
+    def test_sizer(self):
+        cache = self._makeone(self.initstring, max_bytes=250, sizer=len)
+        for i in range(10):
+            cache[str(i)] = 'x' * 100
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.stats()['bytes'], 200)
+
+    def test_stats(self):
+        cache = self._makeone(self.initstring, max_entries=1)
+        cache['test'] = 'test'
+        cache['test']
+        cache['test2'] = 'test2'
+        self.assertRaises(KeyError, lambda: cache['test'])
+        stats = cache.stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['evictions'], 1)
+        self.assertEqual(stats['entries'], 1)
+
+
+class TestSimpleCache(CachePolicy, unittest.TestCase):
 
     initstring = 'simple://'
 
@@ -62,7 +186,7 @@ class TestSimpleCache(CacheCull, unittest.TestCase):
         return SimpleCache
 
 
-class TestSimpleLRUCache(NoTimeout, unittest.TestCase):
+class TestSimpleLRUCache(LRUCache, unittest.TestCase):
 
     initstring = 'simplelru://'
 
@@ -72,7 +196,7 @@ class TestSimpleLRUCache(NoTimeout, unittest.TestCase):
         return SimpleLRUCache
 
 
-class TestMemoryCache(CacheCull, unittest.TestCase):
+class TestMemoryCache(CachePolicy, unittest.TestCase):
 
     initstring = 'memory://'
 
@@ -81,8 +205,21 @@ class TestMemoryCache(CacheCull, unittest.TestCase):
         from shove.cache import MemoryCache
         return MemoryCache
 
+    def test_isolation(self):
+        value = dict(max=[3])
+        for isolation, same in (
+            ('deepcopy', False), ('frozen', True), ('serialized', False),
+        ):
+            cache = self._makeone(self.initstring, isolation=isolation)
+            cache.set_many(dict(test=value))
+            self.assertEqual(cache['test'] is value, same)
+            self.assertEqual(cache.get_many(['test']), dict(test=value))
+        self.assertRaises(
+            ValueError, self._makeone, self.initstring, isolation='shared',
+        )
 
-class TestMemoryLRUCache(NoTimeout, unittest.TestCase):
+
+class TestMemoryLRUCache(LRUCache, unittest.TestCase):
 
     initstring = 'memlru://'
 
@@ -92,7 +229,7 @@ class TestMemoryLRUCache(NoTimeout, unittest.TestCase):
         return MemoryLRUCache
 
 
-class TestFileCache(CacheCull, unittest.TestCase):
+class TestFileCache(CachePolicy, unittest.TestCase):
 
     initstring = 'file://test'
 
@@ -106,8 +243,18 @@ class TestFileCache(CacheCull, unittest.TestCase):
         self.cache = None
         shutil.rmtree('test')
 
+    def test_manifest(self):
+        self.cache = self._makeone(self.initstring, fanout=2, manifest=True)
+        self.cache['test'] = 'test'
+        self.cache['test2'] = 'test2'
+        del self.cache['test']
+        self.cache.close()
+        self.cache = self._makeone(self.initstring, fanout=2, manifest=True)
+        self.assertEqual(list(self.cache), ['test2'])
+        self.assertEqual(self.cache['test2'], 'test2')
+
 
-class TestFileLRUCache(NoTimeout, unittest.TestCase):
+class TestFileLRUCache(LRUCache, unittest.TestCase):
 
     initstring = 'filelru://test2'
 
@@ -132,6 +279,79 @@ class TestDBCache(CacheCull, unittest.TestCase):
         return DBCache
 
 
+class TestShmCache(CacheCull, unittest.TestCase):
+
+    initstring = 'shm://test'
+
+    @property
+    def _makeone(self):
+        from shove.caches.shm import ShmCache
+        return ShmCache
+
+    def tearDown(self):
+        import os
+        self.cache.close()
+        os.remove(self.cache._path)
+
+
+class TestTieredCache(NoTimeout, unittest.TestCase):
+
+    initstring = ['memlru://', 'simple://']
+
+    def _makeone(self, uri, **kw):
+        from shove._imports import cache_backend
+        return cache_backend(uri, **kw)
+
+    def test_promote(self):
+        cache = self._makeone(self.initstring, promote=2)
+        first, second = cache._tiers
+        second['test'] = 'test'
+        self.assertEqual(cache['test'], 'test')
+        self.assertEqual('test' in first, False)
+        self.assertEqual(cache.get_many(['test']), dict(test='test'))
+        self.assertEqual(first['test'], 'test')
+        stats = cache.stats()
+        self.assertEqual(stats['promotions'], 1)
+        self.assertEqual(
+            [(i['hits'], i['misses']) for i in stats['tiers']],
+            [(0, 2), (2, 0)],
+        )
+        cache = self._makeone(self.initstring, promote=0)
+        cache._tiers[1]['test'] = 'test'
+        cache['test']
+        self.assertEqual('test' in cache._tiers[0], False)
+
+    def test_demote(self):
+        cache = self._makeone(self.initstring, demote=True, max_entries=2)
+        first, second = cache._tiers
+        cache.set_many(dict(test='test', test2='test2'))
+        self.assertEqual(len(second), 0)
+        cache['test3'] = 'test3'
+        # the least recently used entry moved down a tier
+        self.assertEqual('test' in first, False)
+        self.assertEqual(second['test'], 'test')
+        self.assertEqual(cache['test'], 'test')
+        self.assertEqual(cache.stats()['demotions'] >= 1, True)
+
+    def test_tier_timeouts(self):
+        cache = self._makeone(self.initstring, tier_timeouts=[10, None])
+        self.assertEqual(
+            [i.timeout for i in cache._tiers], [10, 300],
+        )
+        cache.set('test', 'test', ttl=-1)
+        self.assertRaises(KeyError, cache.__getitem__, 'test')
+
+    def test_shove(self):
+        from shove import Shove
+        store = Shove('simple://', self.initstring, sync=0)
+        store['max'] = 3
+        self.assertEqual(store._cache._tiers[1]['max'], 3)
+        store._cache._tiers[0].delete_many(['max'])
+        self.assertEqual(store['max'], 3)
+        self.assertEqual(store._cache.stats()['tiers'][1]['hits'], 1)
+        store.close()
+
+
 if not PY3:
     class TestMemcache(Cache, Spawn, unittest.TestCase):
 
@@ -108,6 +108,19 @@ class Multi(object):
         self.store.sync()
         self.assertEqual(self.store['pow'], 8)
 
+    def test_set_many(self):
+        self.store.set_many(dict(max=3, min=6, pow=7))
+        self.store.sync()
+        self.assertEqual(
+            self.store.get_many(['max', 'pow', 'nothere']), dict(max=3, pow=7),
+        )
+
+    def test_delete_many(self):
+        self.store.set_many(dict(max=3, min=6, pow=7))
+        self.store.sync()
+        self.store.delete_many(['max', 'pow'])
+        self.assertEqual(len(self.store), 1)
+
     def test_update(self):
         from shove.core import MultiShove
         tstore = MultiShove()
@@ -158,6 +171,28 @@ class TestThreadShove(unittest.TestCase):
         self.store.close()
         shutil.rmtree('six')
 
+    def test_workers(self):
+        self.store['max'] = 3
+        self.store.set_many(dict(min=6, pow=7))
+        del self.store['min']
+        self.store.sync()
+        for store in self.store._stores:
+            self.assertEqual(sorted(store.keys()), ['max', 'pow'])
+        # one pool is kept for the life of the instance
+        self.assertEqual(len(set(self.store._executors)), 1)
+        self.store.close()
+        self.assertEqual(self.store._executors, None)
+
+    def test_queues(self):
+        from shove.core import ThreadShove
+        self.store.close()
+        self.store = ThreadShove(*self.stores, queues=True, sync=0)
+        self.assertEqual(len(set(self.store._executors)), len(self.stores))
+        self.store.set_many(dict(max=3, min=6))
+        self.store.delete_many(['min'])
+        for store in self.store._stores:
+            self.assertEqual(list(store.keys()), ['max'])
+
 
 if __name__ == '__main__':
     unittest.main()
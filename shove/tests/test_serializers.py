@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+'''shove serializer tests'''
+
+import sys
+
+from stuf.six import unittest
+
+from shove.serializers import codecs, serializers
+
+
+class TestSerializers(unittest.TestCase):
+
+    def _makeone(self, **kw):
+        from shove.base import Base
+        return Base('test', **kw)
+
+    def test_header(self):
+        from shove.serializers import HEADER
+        base = self._makeone(compress=True)
+        value = base.dumps(dict(max='3' * 100))
+        self.assertEqual(ord(value[:1]), HEADER + 1)
+        self.assertEqual(base.loads(value), dict(max='3' * 100))
+
+    def test_roundtrip(self):
+        values = dict(
+            pickle=dict(max=3), marshal=dict(max=3), json=dict(max=3),
+            bytes=b'max', str=u'm\xe4x',
+        )
+        for name, value in values.items():
+            base = self._makeone(serializer=name)
+            self.assertEqual(base.loads(base.dumps(value)), value)
+
+    def test_fastpath(self):
+        from shove.serializers import HEADER
+        base = self._makeone()
+        for value, ident in (
+            (b'max', 4), (u'm\xe4x', 5), (3, 6), (-2 ** 70, None),
+            (True, 0), (3.0, 0),
+        ):
+            data = base.dumps(value)
+            if ident is not None:
+                self.assertEqual(ord(data[:1]), HEADER + ident * 8)
+            result = base.loads(data)
+            self.assertEqual(result, value)
+            self.assertEqual(type(result), type(value))
+        self.assertEqual(base.dumps(3)[1:], b'3')
+        plain = self._makeone(fastpath=False)
+        self.assertEqual(ord(plain.dumps(b'max')[:1]), HEADER)
+
+    @unittest.skipUnless(
+        'pickle5' in serializers, 'requires pickle protocol 5',
+    )
+    def test_buffers(self):
+        from pickle import PickleBuffer
+        from shove.serializers import HEADER
+        base = self._makeone(serializer='pickle5', compress=True)
+        big = b'x' * 100000
+        value = dict(big=PickleBuffer(big), small=PickleBuffer(b'y' * 10))
+        parts = base._dumpparts(value)
+        # the big buffer is a segment of its own and nothing is compressed
+        self.assertEqual(ord(parts[0]), HEADER + 7 * 8)
+        self.assertEqual(parts[-1].obj, big)
+        data = base.dumps(value)
+        result = base.loads(data)
+        # out-of-band buffers load as views of the stored value
+        self.assertEqual(isinstance(result['big'], memoryview), True)
+        self.assertEqual(result['big'].obj, data)
+        self.assertEqual(bytes(result['big']), big)
+        self.assertEqual(bytes(result['small']), b'y' * 10)
+        self.assertEqual(base.loads(base.dumps(dict(max=3))), dict(max=3))
+        # uploads read the segments as one file
+        from shove.base import Segments
+        segments = Segments(parts)
+        self.assertEqual(segments.read(3) + segments.read(), data)
+        segments.seek(-5, 2)
+        self.assertEqual(segments.read(), b'x' * 5)
+        self.assertEqual(segments.tell(), len(data))
+
+    def test_mixed(self):
+        reader = self._makeone(serializer='pickle')
+        for name in ('marshal', 'json'):
+            writer = self._makeone(serializer=name, compress=True)
+            self.assertEqual(reader.loads(writer.dumps([1, 2])), [1, 2])
+
+    def test_codecs(self):
+        from shove.serializers import HEADER, codecs
+        value = dict(max='3' * 1000)
+        for name in codecs:
+            base = self._makeone(compress=True, codec=name)
+            data = base.dumps(value)
+            self.assertEqual(ord(data[:1]), HEADER + codecs[name].ident)
+            self.assertEqual(base.loads(data), value)
+
+    def test_compress_min(self):
+        from shove.serializers import HEADER
+        base = self._makeone(compress=True, compress_min=1000)
+        value = [3] * 100
+        self.assertEqual(ord(base.dumps(value)[:1]), HEADER)
+        self.assertEqual(ord(base.dumps(value * 10)[:1]), HEADER + 1)
+
+    def test_incompressible(self):
+        import os
+        from shove.serializers import HEADER
+        base = self._makeone(compress=True, serializer='bytes')
+        value = os.urandom(1000)
+        data = base.dumps(value)
+        self.assertEqual(ord(data[:1]), HEADER + 4 * 8)
+        self.assertEqual(len(data), 1001)
+        self.assertEqual(base.loads(data), value)
+
+    @unittest.skipUnless('zdict' in codecs, 'requires zlib zdict support')
+    def test_zdict(self):
+        import shutil
+        from tempfile import mkdtemp
+        path = mkdtemp()
+        try:
+            base = self._makeone(
+                compress=True, codec='zdict', zdict=path, compress_min=0,
+            )
+            samples = [
+                dict(name='user%d' % i, email='user%d@example.com' % i, id=i)
+                for i in range(100)
+            ]
+            plain = self._makeone(compress=True, compress_min=0)
+            value = samples[0]
+            first = base.dumps(value)
+            self.assertEqual(base.train(samples), 1)
+            second = base.dumps(value)
+            self.assertEqual(len(second) < len(plain.dumps(value)), True)
+            self.assertEqual(base.train(samples[50:]), 2)
+            # a fresh instance reads every dictionary version from disk
+            other = self._makeone(zdict=path)
+            for data in (first, second, base.dumps(value)):
+                self.assertEqual(other.loads(data), value)
+        finally:
+            shutil.rmtree(path)
+
+    def test_unavailable_codec(self):
+        self.assertRaises(
+            ValueError, self._makeone, compress=True, codec='missing',
+        )
+
+    @unittest.skipIf(sys.version_info < (3, 4), 'requires pickle protocol 4')
+    def test_optimize(self):
+        value = dict(max=[3] * 10)
+        for base in (
+            self._makeone(protocol=2, timings=True),
+            self._makeone(protocol=4, optimize=True, timings=True),
+        ):
+            self.assertEqual(base.loads(base.dumps(value)), value)
+            self.assertEqual(base.timings()['optimize']['calls'], 1)
+        # framed protocols and large pickles skip the optimize pass
+        for base in (
+            self._makeone(protocol=4, timings=True),
+            self._makeone(protocol=2, optimize_max=10, timings=True),
+            self._makeone(protocol=2, optimize=False, timings=True),
+        ):
+            self.assertEqual(base.loads(base.dumps(value)), value)
+            self.assertEqual('optimize' in base.timings(), False)
+
+    def test_timings(self):
+        base = self._makeone(compress=True, timings=True)
+        base.loads(base.dumps(dict(max='3' * 100)))
+        timings = base.timings()
+        for phase in ('serialize', 'compress', 'decompress', 'deserialize'):
+            self.assertEqual(timings[phase]['calls'], 1)
+            self.assertEqual(timings[phase]['seconds'] >= 0, True)
+        self.assertEqual(self._makeone().timings(), {})
+
+    def test_legacy(self):
+        import pickle
+        from zlib import compress
+        base = self._makeone(compress=True)
+        value = pickle.dumps(dict(max=3), 2)
+        self.assertEqual(base.loads(value), dict(max=3))
+        self.assertEqual(base.loads(compress(value)), dict(max=3))
+
+    def test_memoryview(self):
+        base = self._makeone(compress=True)
+        value = memoryview(base.dumps(dict(max=3)))
+        self.assertEqual(base.loads(value), dict(max=3))
+
+    def test_unknown(self):
+        from shove.serializers import HEADER
+        base = self._makeone()
+        self.assertRaises(
+            ValueError, base.loads, bytearray([HEADER + 11 * 8]) + b'x',
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
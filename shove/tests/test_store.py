@@ -133,6 +133,48 @@ class Store(object):
         self.assertEqual(self.store._buffer, None)
         self.assertEqual(self.store._cache, None)
 
+    def test_set_ttl(self):
+        self.store.set('max', 3, ttl=-1)
+        self.store.sync()
+        # only the cached copy expires
+        self.assertRaises(KeyError, self.store._cache.__getitem__, 'max')
+        self.assertEqual(self.store['max'], 3)
+
+    def test_set_many(self):
+        self.store.set_many(dict(max=3, min=6, pow=7))
+        self.store.sync()
+        self.assertEqual(len(self.store), 3)
+        self.assertEqual(self.store['pow'], 7)
+
+    def test_get_many(self):
+        self.store.set_many(dict(max=3, min=6, pow=7))
+        self.store.sync()
+        self.assertEqual(
+            self.store.get_many(['max', 'pow', 'nothere']), dict(max=3, pow=7),
+        )
+
+    def test_delete_many(self):
+        self.store.set_many(dict(max=3, min=6, pow=7))
+        self.store.sync()
+        self.store.delete_many(['max', 'pow', 'nothere'])
+        self.assertEqual(list(self.store.keys()), ['min'])
+
+    def test_pending(self):
+        from shove import Shove
+        self.store.close()
+        self.store = Shove(self.initstring, sync=100)
+        self.store.set_many(dict(max=3, min=6))
+        self.store._cache.delete_many(['max', 'min'])
+        self.assertEqual(self.store['max'], 3)
+        self.assertEqual(
+            self.store.get_many(['min', 'nothere']), dict(min=6),
+        )
+        # misses are served from the buffer without writing it
+        self.assertEqual(len(self.store._buffer), 2)
+        self.assertRaises(KeyError, self.store._store.__getitem__, 'max')
+        self.store.sync()
+        self.assertEqual(self.store._store['min'], 6)
+
 
 class TestSimpleStore(Store, unittest.TestCase):
 
@@ -143,6 +185,189 @@ class TestMemoryStore(Store, unittest.TestCase):
 
     initstring = 'memory://'
 
+    def test_single_flight(self):
+        import time
+        import threading
+        self.store['max'] = 3
+        self.store._cache.delete_many(['max'])
+        release = threading.Event()
+        load = self.store._load
+        calls = list()
+
+        def slow(key):
+            calls.append(key)
+            release.wait()
+            return load(key)
+
+        self.store._load = slow
+        results = list()
+        readers = list(
+            threading.Thread(
+                target=lambda: results.append(self.store['max'])
+            ) for i in range(8)
+        )
+        for reader in readers:
+            reader.start()
+        time.sleep(0.2)
+        release.set()
+        for reader in readers:
+            reader.join()
+        self.assertEqual(results, [3] * 8)
+        self.assertEqual(calls, ['max'])
+
+    def test_isolation(self):
+        from shove import Shove
+        value = dict(max=[3])
+        for isolation, same in (
+            ('deepcopy', False), ('frozen', True), ('serialized', False),
+        ):
+            self.store.close()
+            self.store = Shove(self.initstring, isolation=isolation, sync=0)
+            self.store['max'] = value
+            store = self.store._store
+            self.assertEqual(store['max'] is value, same)
+            self.assertEqual(store.get_many(['max']), dict(max=value))
+        # serialized values are stored as bytes
+        self.assertEqual(isinstance(store._store['max'], bytes), True)
+
+    def test_shared_reads(self):
+        import threading
+        self.store['max'] = 3
+        lock = self.store._store._lock
+        lock.acquire_read()
+        try:
+            # other readers get in while a writer waits for the readers
+            reader = threading.Thread(
+                target=self.store._store.get_many, args=(['max'],),
+            )
+            reader.start()
+            reader.join(1)
+            self.assertEqual(reader.is_alive(), False)
+            writer = threading.Thread(
+                target=self.store._store.__setitem__, args=('min', 6),
+            )
+            writer.start()
+            writer.join(0.2)
+            self.assertEqual(writer.is_alive(), True)
+        finally:
+            lock.release_read()
+        writer.join()
+        self.assertEqual(self.store._store['min'], 6)
+
+
+class TestBackgroundStore(Store, unittest.TestCase):
+
+    initstring = 'memory://'
+
+    def setUp(self):
+        from shove import Shove
+        self.store = Shove(
+            self.initstring, compress=True, sync=2, background=True,
+        )
+
+    def test_interval(self):
+        import time
+        from shove import Shove
+        self.store.close()
+        self.store = Shove(
+            self.initstring, sync=100, background=True, sync_interval=0.05,
+        )
+        self.store['max'] = 3
+        time.sleep(0.5)
+        self.assertEqual(self.store._store['max'], 3)
+
+    def test_sync_bytes(self):
+        import time
+        from shove import Shove
+        self.store.close()
+        self.store = Shove(
+            self.initstring, sync=100, background=True, sync_interval=None,
+            sync_bytes=1000,
+        )
+        self.store['min'] = 6
+        self.store['max'] = 'x' * 1000
+        time.sleep(0.5)
+        self.assertEqual(self.store._store['min'], 6)
+
+    def test_backpressure(self):
+        import threading
+        from shove import Shove
+        self.store.close()
+        self.store = Shove(
+            self.initstring, sync=2, background=True, sync_interval=None,
+            sync_limit=2,
+        )
+        store = self.store._store
+        release = threading.Event()
+        write = store.set_many
+
+        def slow(mapping):
+            release.wait()
+            write(mapping)
+
+        store.set_many = slow
+        try:
+            # starts a write that waits for the release
+            self.store.update(max=3, min=6)
+            self.store.update(pow=7, one=1)
+            writer = threading.Thread(
+                target=self.store.__setitem__, args=('two', 2),
+            )
+            writer.start()
+            writer.join(0.2)
+            # the buffer is full while the write is in progress
+            self.assertEqual(writer.is_alive(), True)
+        finally:
+            release.set()
+        writer.join()
+        self.store.sync()
+        self.assertEqual(len(store), 5)
+
+    def test_error(self):
+        from shove import Shove
+        self.store.close()
+        self.store = Shove(self.initstring, sync=100, background=True)
+        store = self.store._store
+        write = store.set_many
+
+        def fail(mapping):
+            raise IOError('down')
+
+        store.set_many = fail
+        self.store['max'] = 3
+        self.assertRaises(IOError, self.store.sync)
+        store.set_many = write
+        self.store.sync()
+        self.assertEqual(store['max'], 3)
+
+    def test_pending(self):
+        import threading
+        from shove import Shove
+        self.store.close()
+        self.store = Shove(
+            self.initstring, sync=2, background=True, sync_interval=None,
+        )
+        store = self.store._store
+        release = threading.Event()
+        write = store.set_many
+
+        def slow(mapping):
+            release.wait()
+            write(mapping)
+
+        store.set_many = slow
+        try:
+            # the write waits for the release, so both objects are pending
+            self.store.set_many(dict(max=3, min=6))
+            self.store._cache.delete_many(['max', 'min'])
+            self.assertEqual(self.store['max'], 3)
+            self.assertEqual(self.store.get_many(['min']), dict(min=6))
+            self.assertRaises(KeyError, store.__getitem__, 'max')
+        finally:
+            release.set()
+        self.store.sync()
+        self.assertEqual(store['min'], 6)
+
 
 class TestFileStore(Store, unittest.TestCase):
 
@@ -153,6 +378,278 @@ class TestFileStore(Store, unittest.TestCase):
         self.store.close()
         shutil.rmtree('test')
 
+    def test_durable(self):
+        import os
+        from shove import Shove
+        self.store.close()
+        for durable in ('always', 'batch'):
+            self.store = Shove(self.initstring, sync=2, durable=durable)
+            self.store.update(max=3, min=6)
+            del self.store['min']
+            self.store['pow'] = 7
+            self.store.close()
+            self.store = Shove(self.initstring, durable=durable)
+            self.assertEqual(sorted(self.store.keys()), ['max', 'pow'])
+            self.assertEqual(self.store['pow'], 7)
+            self.store.clear()
+            self.store.close()
+        self.store = Shove(self.initstring)
+        self.store['max'] = 3
+        self.store.sync()
+        for _, _, names in os.walk('test'):
+            self.assertEqual([i for i in names if i.endswith('.tmp')], [])
+        self.assertRaises(
+            ValueError, Shove, self.initstring, durable='sometimes',
+        )
+
+    def test_stale_temp(self):
+        import os
+        from shove import Shove
+        self.store.close()
+        # a process id above any real one belongs to a dead writer
+        stale = os.path.join('test', '.99999999.0.tmp')
+        live = os.path.join('test', '.{0}.0.tmp'.format(os.getpid()))
+        for path in (stale, live):
+            with open(path, 'wb') as item:
+                item.write(b'x')
+        self.store = Shove(self.initstring)
+        self.assertEqual(os.path.exists(stale), False)
+        self.assertEqual(os.path.exists(live), True)
+        os.remove(live)
+
+    def test_mmap(self):
+        from shove import Shove
+        self.store.close()
+        self.store = Shove(self.initstring, compress=True, sync=0, mmap=True)
+        self.store['max'] = 3
+        self.store['big'] = b'x' * 100000
+        self.store.sync()
+        store = self.store._store
+        self.assertEqual(store['max'], 3)
+        self.assertEqual(store['big'], b'x' * 100000)
+
+    def test_buffers(self):
+        from shove import Shove
+        from shove.serializers import serializers
+        if 'pickle5' not in serializers:
+            self.skipTest('requires pickle protocol 5')
+        from pickle import PickleBuffer
+        self.store.close()
+        for mmap in (False, True):
+            self.store = Shove(
+                self.initstring, sync=0, serializer='pickle5', mmap=mmap,
+            )
+            self.store['big'] = dict(data=PickleBuffer(b'x' * 100000), id=1)
+            self.store.sync()
+            value = self.store._store['big']
+            self.assertEqual(bytes(value['data']), b'x' * 100000)
+            self.assertEqual(value['id'], 1)
+            del value
+            self.store.close()
+        self.store = Shove(self.initstring)
+
+    def test_mmap_corrupt(self):
+        from shove import Shove
+        self.store.close()
+        self.store = Shove(self.initstring, sync=0, mmap=True)
+        self.store['max'] = 3
+        self.store.sync()
+        store = self.store._store
+        with open(store._key_to_file('max'), 'wb') as item:
+            item.write(b'\xa0not a pickle')
+        # the load error surfaces instead of the map's BufferError
+        try:
+            store['max']
+        except BufferError:
+            self.fail('BufferError hid the load error')
+        except Exception:
+            pass
+        else:
+            self.fail('corrupt value loaded')
+
+
+class TestFileShardedStore(TestFileStore):
+
+    def setUp(self):
+        from shove import Shove
+        self.store = Shove(
+            self.initstring, optimize=False, compress=True, sync=0,
+            fanout=2, manifest=True,
+        )
+
+    def test_fanout(self):
+        import os
+        self.store['max'] = 3
+        self.store.sync()
+        path = self.store._store._key_to_file('max')
+        self.assertEqual(os.path.exists(path), True)
+        self.assertEqual(len(os.path.relpath(path, 'test').split(os.sep)), 3)
+
+    def test_manifest(self):
+        from shove import Shove
+        self.store.update(max=3, min=6, pow=7)
+        del self.store['min']
+        self.store.sync()
+        self.store.close()
+        self.store = Shove(self.initstring, sync=0, fanout=2, manifest=True)
+        self.assertEqual(sorted(self.store.keys()), ['max', 'pow'])
+        self.assertEqual('min' in self.store, False)
+
+    def test_manifest_reader(self):
+        from shove import Shove
+        self.store['max'] = 3
+        self.store.sync()
+        reader = Shove(self.initstring, sync=0, fanout=2, manifest=True)
+        self.store['min'] = 6
+        self.store.close()
+        # closing an instance that wrote nothing keeps the other's records
+        reader.close()
+        self.store = Shove(self.initstring, sync=0, fanout=2, manifest=True)
+        self.assertEqual(sorted(self.store.keys()), ['max', 'min'])
+
+    def test_rebuild_manifest(self):
+        import os
+        from shove import Shove
+        self.store.update(max=3, min=6)
+        self.store.close()
+        os.remove(os.path.join('test', '.manifest'))
+        self.store = Shove(self.initstring, sync=0, fanout=2, manifest=True)
+        self.assertEqual(len(self.store), 2)
+        self.assertEqual('max' in self.store._store, True)
+
+
+class TestShmStore(Store, unittest.TestCase):
+
+    initstring = 'shm://test'
+
+    def tearDown(self):
+        import os
+        from shove.stores.shm import SHMDIR
+        self.store.close()
+        os.remove(os.path.join(SHMDIR, 'shove-test'))
+
+    def test_grow(self):
+        from shove import Shove
+        self.store.close()
+        self.store = Shove(self.initstring, slots=4, size=0, sync=0)
+        self.store.update(dict(('key%d' % i, 'x' * i) for i in range(100)))
+        for i in range(0, 100, 2):
+            self.store['key%d' % i] = i
+        del self.store['key1']
+        self.assertEqual(len(self.store), 99)
+        self.assertEqual(self.store['key3'], 'xxx')
+        self.assertEqual(self.store._store['key4'], 4)
+        # another instance maps the grown file
+        other = Shove(self.initstring)
+        self.assertEqual(other['key99'], 'x' * 99)
+        other.close()
+
+    def test_processes(self):
+        import os
+        self.store['max'] = 3
+        pid = os.fork()
+        if not pid:
+            # the forked child writes through the inherited store
+            try:
+                self.store._store['min'] = self.store._store['max'] * 2
+            finally:
+                os._exit(0)
+        os.waitpid(pid, 0)
+        self.assertEqual(self.store._store['min'], 6)
+
+
+class TestLogStore(Store, unittest.TestCase):
+
+    initstring = 'log://test5'
+
+    def tearDown(self):
+        import shutil
+        self.store.close()
+        shutil.rmtree('test5')
+
+    def test_reopen(self):
+        from shove import Shove
+        self.store.update(max=3, min=6, pow=7)
+        del self.store['min']
+        self.store['pow'] = 8
+        self.store.close()
+        self.store = Shove(self.initstring, compress=True, sync=0)
+        self.assertEqual(sorted(self.store.keys()), ['max', 'pow'])
+        self.assertEqual(self.store['pow'], 8)
+
+    def test_buffers(self):
+        from shove import Shove
+        from shove.serializers import serializers
+        if 'pickle5' not in serializers:
+            self.skipTest('requires pickle protocol 5')
+        from pickle import PickleBuffer
+        self.store.close()
+        self.store = Shove(
+            self.initstring, sync=0, serializer='pickle5', mmap=True,
+        )
+        self.store.update(
+            big=PickleBuffer(b'x' * 100000), small=PickleBuffer(b'y'),
+        )
+        self.store.sync()
+        self.assertEqual(bytes(self.store._store['big']), b'x' * 100000)
+        self.store._store.compact()
+        self.assertEqual(bytes(self.store._store['big']), b'x' * 100000)
+        self.assertEqual(bytes(self.store._store['small']), b'y')
+
+    def test_durable(self):
+        from shove.stores.logstore import LogStore
+        self.assertRaises(ValueError, LogStore, 'log://test5', durable='yes')
+
+    def test_torn_record(self):
+        from shove import Shove
+        self.store.update(max=3, min=6)
+        self.store.sync()
+        store = self.store._store
+        path = store._path(store._segment, '.log')
+        store._shut()
+        with open(path, 'ab') as data:
+            data.write(b'\x00\x01')
+        self.store = Shove(self.initstring, compress=True, sync=0)
+        self.assertEqual(self.store['min'], 6)
+        self.store['pow'] = 7
+        self.assertEqual(self.store['pow'], 7)
+
+    def test_compact(self):
+        from shove import Shove
+        self.store.close()
+        self.store = Shove(
+            self.initstring, compress=True, sync=0, segment_size=64,
+        )
+        for i in range(20):
+            self.store['max'] = i
+            self.store['min%d' % i] = i
+        for i in range(10):
+            del self.store['min%d' % i]
+        store = self.store._store
+        before = len(store._segments)
+        store.compact()
+        self.assertEqual(len(store._segments) < before, True)
+        self.assertEqual(self.store['max'], 19)
+        self.assertEqual(len(self.store), 11)
+        self.store.close()
+        self.store = Shove(self.initstring, compress=True, sync=0)
+        self.assertEqual(self.store['max'], 19)
+        self.assertEqual(self.store['min15'], 15)
+        self.assertEqual('min5' in self.store, False)
+
+    def test_mmap(self):
+        from shove import Shove
+        self.store.close()
+        self.store = Shove(self.initstring, sync=0, mmap=True)
+        self.store.update(max=3, min=6)
+        store = self.store._store
+        self.assertEqual(store['max'], 3)
+        # reads after more appends remap the active segment
+        store['pow'] = b'x' * 100000
+        self.assertEqual(store.get_many(['min', 'pow']), dict(
+            min=6, pow=b'x' * 100000,
+        ))
+
 
 class TestHgStore(Store, unittest.TestCase):
 
@@ -191,6 +688,111 @@ class TestDBStore(Store, unittest.TestCase):
 
     initstring = 'sqlite://'
 
+    def test_pool_options(self):
+        from shove import Shove
+        store = Shove('sqlite://?pool_recycle=60', pool_pre_ping=True)
+        pool = store._store._engine.pool
+        self.assertEqual(pool._recycle, 60)
+        self.assertEqual(pool._pre_ping, True)
+        store.close()
+
+    def test_upsert(self):
+        store = self.store._store
+        store.set_many(dict(max=3, min=6))
+        store.set_many(dict(max=4, pow=7))
+        store['min'] = 5
+        self.assertEqual(store.get_many(['max', 'min', 'pow']), dict(
+            max=4, min=5, pow=7,
+        ))
+        self.assertEqual(len(store), 3)
+
+    def test_upsert_fallback(self):
+        store = self.store._store
+        store._upsert_stmt = None
+        store['max'] = 3
+        store['max'] = 4
+        self.assertEqual(store['max'], 4)
+        self.assertEqual(len(store), 1)
+
+    def test_upsert_dialects(self):
+        from importlib import import_module
+        from sqlalchemy import (
+            MetaData, Table, Column, String, LargeBinary, DateTime,
+        )
+        from shove.stores.db import DBBase
+        table = Table(
+            'cache', MetaData(),
+            Column('key', String(60), primary_key=True),
+            Column('value', LargeBinary),
+            Column('expires', DateTime),
+        )
+        expected = dict(
+            postgresql='ON CONFLICT', mysql='ON DUPLICATE KEY UPDATE',
+            sqlite='OR REPLACE', mssql='MERGE INTO', oracle='MERGE INTO',
+            firebird='MERGE INTO',
+        )
+        for name, clause in expected.items():
+            dialect = import_module('sqlalchemy.dialects.' + name).dialect()
+            base = DBBase()
+            base._engine = type('Engine', (object,), dict(dialect=dialect))
+            compiled = base._upserter(table).compile(dialect=dialect)
+            self.assertEqual(clause in str(compiled), True)
+            binds = compiled.binds
+            self.assertEqual(isinstance(binds['value'].type, LargeBinary), True)
+            self.assertEqual(isinstance(binds['expires'].type, DateTime), True)
+
+    def test_zdict(self):
+        import os
+        import shutil
+        from tempfile import mkdtemp
+        from shove.serializers import codecs
+        from shove.stores.db import DBStore
+        if 'zdict' not in codecs:
+            self.skipTest('requires zlib zdict support')
+        path = mkdtemp()
+        engine = 'sqlite:///' + os.path.join(path, 'test.db')
+        try:
+            store = DBStore(
+                engine, compress=True, codec='zdict', compress_min=0,
+            )
+            store.train(list(
+                dict(name='user%d' % i, email='user%d@example.com' % i)
+                for i in range(100)
+            ))
+            store['max'] = dict(name='max', email='max@example.com')
+            store.close()
+            # dictionaries are read back from the database, not a directory
+            store = DBStore(engine)
+            self.assertEqual(store._zdicts.latest()[0], 1)
+            self.assertEqual(store['max']['name'], 'max')
+            store.close()
+        finally:
+            shutil.rmtree(path)
+
+    def test_threads(self):
+        from concurrent.futures import ThreadPoolExecutor
+        store = self.store._store
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            futures = list(
+                executor.submit(store.set_many, {str(i): i})
+                for i in range(64)
+            )
+        for future in futures:
+            future.result()
+        self.assertEqual(len(store), 64)
+        self.assertEqual(store['63'], 63)
+
+    def test_unpooled_options(self):
+        import os
+        from tempfile import mkdtemp
+        from shove.stores.db import DBStore
+        path = os.path.join(mkdtemp(), 'test.db')
+        store = DBStore('sqlite:///' + path, pool_size=5, pool_recycle=60)
+        store['max'] = 3
+        self.assertEqual(store['max'], 3)
+        store.close()
+        os.remove(path)
+
 
 class TestMongoDBStore(Store, Spawn, unittest.TestCase):
 
@@ -273,6 +875,25 @@ if not PY3:
                 self.store.clear()
                 self.store.close()
 
+    class TestRedisPrefixStore(TestRedisStore):
+
+        def setUp(self):
+            from shove import Shove
+            self.store = Shove(self.initstring, prefix='shove:', sync=0)
+
+        def test_namespace(self):
+            from shove import Shove
+            other = Shove(self.initstring, prefix='other:', sync=0)
+            other['max'] = 1
+            other.sync()
+            self.store['max'] = 3
+            self.store.sync()
+            self.store._store.clear()
+            self.assertEqual(len(self.store), 0)
+            self.assertEqual(other['max'], 1)
+            other._store.clear()
+            other.close()
+
     @unittest.skip('reason')
     class TestBSDBStore(Store, unittest.TestCase):
 